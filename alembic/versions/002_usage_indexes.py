@@ -0,0 +1,41 @@
+"""Add composite indexes for per-user usage and API key lookups."""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '002_usage_indexes'
+down_revision = '001_initial'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside a transaction, but avoids locking writes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_usage_logs_user_created',
+            'usage_logs',
+            ['user_id', sa.text('created_at DESC')],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_api_keys_user_active',
+            'api_keys',
+            ['user_id'],
+            postgresql_where=sa.text('is_active = true'),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f('ix_api_keys_key_prefix'),
+            'api_keys',
+            ['key_prefix'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_api_keys_key_prefix'), table_name='api_keys', postgresql_concurrently=True)
+        op.drop_index('ix_api_keys_user_active', table_name='api_keys', postgresql_concurrently=True)
+        op.drop_index('ix_usage_logs_user_created', table_name='usage_logs', postgresql_concurrently=True)
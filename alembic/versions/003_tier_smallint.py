@@ -0,0 +1,57 @@
+"""Store users.tier as SMALLINT codes instead of VARCHAR enum values."""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '003_tier_smallint'
+down_revision = '002_usage_indexes'
+branch_labels = None
+depends_on = None
+
+# Must match models.TIER_CODES
+TIER_CODES = {'free': 0, 'hobby': 1, 'pro': 2, 'enterprise': 3}
+
+
+def _unknown_tier(column: str) -> str:
+    """CASE fallback that aborts the migration, naming the offending value."""
+    # Casting the message to an integer fails with it quoted in the error
+    return f"CAST('unknown tier: ' || {column}::text AS smallint)"
+
+
+def upgrade() -> None:
+    # The ORM's Enum(UserTier) stored member names ('FREE'), while 001
+    # declared lowercase values; accept either spelling.
+    to_code = " ".join(f"WHEN '{name}' THEN {code}" for name, code in TIER_CODES.items())
+    op.execute("UPDATE users SET tier = 'free' WHERE tier IS NULL")
+    op.alter_column(
+        'users',
+        'tier',
+        type_=sa.SmallInteger(),
+        existing_type=sa.String(length=10),
+        nullable=False,
+        server_default='0',
+        postgresql_using=(
+            f"CASE lower(tier::text) {to_code} "
+            f"ELSE {_unknown_tier('tier')} END"
+        ),
+    )
+    # The native enum type from 001 was never used by the column
+    op.execute("DROP TYPE IF EXISTS usertier")
+
+
+def downgrade() -> None:
+    # Back to enum member names, which is what Enum(UserTier) reads
+    to_name = " ".join(f"WHEN {code} THEN '{name.upper()}'" for name, code in TIER_CODES.items())
+    op.alter_column('users', 'tier', server_default=None)
+    op.alter_column(
+        'users',
+        'tier',
+        type_=sa.String(length=10),
+        existing_type=sa.SmallInteger(),
+        nullable=True,
+        postgresql_using=(
+            f"CASE tier {to_name} "
+            f"ELSE {_unknown_tier('tier')}::text END"
+        ),
+    )
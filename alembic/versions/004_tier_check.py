@@ -0,0 +1,18 @@
+"""Constrain users.tier to known tier codes."""
+
+from alembic import op
+
+# revision identifiers
+revision = '004_tier_check'
+down_revision = '003_tier_smallint'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Must match models.TIER_CODES
+    op.create_check_constraint('ck_user_tier', 'users', 'tier BETWEEN 0 AND 3')
+
+
+def downgrade() -> None:
+    op.drop_constraint('ck_user_tier', 'users', type_='check')
@@ -0,0 +1,33 @@
+"""Add user_id foreign keys on api_keys and usage_logs."""
+
+from alembic import op
+
+# revision identifiers
+revision = '005_user_foreign_keys'
+down_revision = '004_tier_check'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # NOT VALID + VALIDATE avoids holding an exclusive lock while existing
+    # rows are checked; user_id lookups are served by the composite indexes
+    # from 002, so no separate single-column index is added.
+    op.execute(
+        "ALTER TABLE api_keys ADD CONSTRAINT fk_api_keys_user_id "
+        "FOREIGN KEY (user_id) REFERENCES users (id) NOT VALID"
+    )
+    op.execute(
+        "ALTER TABLE usage_logs ADD CONSTRAINT fk_usage_logs_user_id "
+        "FOREIGN KEY (user_id) REFERENCES users (id) NOT VALID"
+    )
+    # env.py runs every migration in one transaction; commit the ADDs first
+    # so the validating scans don't run under their lock
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TABLE api_keys VALIDATE CONSTRAINT fk_api_keys_user_id")
+        op.execute("ALTER TABLE usage_logs VALIDATE CONSTRAINT fk_usage_logs_user_id")
+
+
+def downgrade() -> None:
+    op.drop_constraint('fk_usage_logs_user_id', 'usage_logs', type_='foreignkey')
+    op.drop_constraint('fk_api_keys_user_id', 'api_keys', type_='foreignkey')
@@ -0,0 +1,42 @@
+"""Store api_keys.key_hash as a truncated HMAC-SHA256 BIGINT."""
+
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers
+revision = '006_key_hash_bigint'
+down_revision = '005_user_foreign_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Stored hashes can't be recomputed without the raw keys, so there is
+    # nothing to backfill: refuse to run if any keys exist (re-issue them).
+    if not context.is_offline_mode():
+        count = op.get_bind().execute(sa.text("SELECT count(*) FROM api_keys")).scalar()
+        if count:
+            raise RuntimeError(
+                f"api_keys has {count} rows; key_hash values cannot be converted. "
+                "Revoke and re-issue existing keys before upgrading."
+            )
+    
+    op.alter_column(
+        'api_keys',
+        'key_hash',
+        type_=sa.BigInteger(),
+        existing_type=sa.String(),
+        existing_nullable=False,
+        postgresql_using='NULL',
+    )
+
+
+def downgrade() -> None:
+    op.alter_column(
+        'api_keys',
+        'key_hash',
+        type_=sa.String(),
+        existing_type=sa.BigInteger(),
+        existing_nullable=False,
+        postgresql_using='key_hash::text',
+    )
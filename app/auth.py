@@ -1,52 +1,189 @@
 """Authentication and API key management."""
 
+import hashlib
+import hmac
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from types import MappingProxyType
+
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import redis_conn
 from app.database import get_db
-from app.config import settings
+from app.config import settings, TIERS
+
+logger = logging.getLogger(__name__)
 
 security = HTTPBearer()
 
+# Read-only user info per key prefix, built once at import from TIERS
+TIER_INFO = {
+    f"kzb_{tier}_": MappingProxyType({"id": f"user_{tier}", "tier": tier, **limits})
+    for tier, limits in TIERS.items()
+}
+# Anchored alternation of all tier prefixes, matched in a single C-level scan
+_PREFIX_RE = re.compile("|".join(map(re.escape, TIER_INFO)))
+
+# Validation cache: blake2b(api_key) -> (expires_at, user dict or None)
+# None marks an invalid key (negative cache, shorter TTL). The process-local
+# cache sits in front of a Redis cache shared by all workers.
+VALIDATION_CACHE_TTL = 300
+INVALID_KEY_CACHE_TTL = 30
+VALIDATION_CACHE_MAXSIZE = 10_000
+
+_validation_cache: dict = {}
+_validation_cache_lock = threading.Lock()
+
+
+def _cache_key(api_key: str) -> bytes:
+    """Hash the raw key so it never sits in the cache in plain text."""
+    return hashlib.blake2b(api_key.encode(), digest_size=16).digest()
+
+
+def _ttl_for(user) -> int:
+    return VALIDATION_CACHE_TTL if user is not None else INVALID_KEY_CACHE_TTL
+
+
+def _cache_get(key: bytes):
+    """Return (hit, value) for a cache key, evicting it if expired."""
+    with _validation_cache_lock:
+        entry = _validation_cache.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del _validation_cache[key]
+            return False, None
+        return True, value
+
 
-def get_current_user(
+def _cache_set(key: bytes, value, ttl: int) -> None:
+    """Store a value, dropping the oldest entry when the cache is full."""
+    with _validation_cache_lock:
+        if key not in _validation_cache and len(_validation_cache) >= VALIDATION_CACHE_MAXSIZE:
+            _validation_cache.pop(next(iter(_validation_cache)))
+        _validation_cache[key] = (time.monotonic() + ttl, value)
+
+
+def clear_validation_cache() -> None:
+    """Drop all cached API key validations held by this process."""
+    with _validation_cache_lock:
+        _validation_cache.clear()
+
+
+def _redis_key(key: bytes) -> str:
+    return f"apikey:{key.hex()}"
+
+
+async def _redis_get(key: bytes):
+    """Return (hit, value) from the shared Redis cache."""
+    if not redis_conn.redis_available:
+        return False, None
+    try:
+        cached = await redis_conn.redis_client.get(_redis_key(key))
+        if cached is None:
+            return False, None
+        user = json.loads(cached)
+        if user is not None:
+            user["tier"] = sys.intern(user["tier"])
+        return True, user
+    except Exception as e:
+        logger.warning("Redis error in get_current_user: %s", e)
+        return False, None
+
+
+async def _redis_set(key: bytes, value, ttl: int) -> None:
+    if not redis_conn.redis_available:
+        return
+    try:
+        payload = json.dumps(None if value is None else dict(value))
+        await redis_conn.redis_client.setex(_redis_key(key), ttl, payload)
+    except Exception as e:
+        logger.warning("Redis error in get_current_user: %s", e)
+
+
+async def invalidate_api_key(api_key: str) -> None:
+    """
+    Drop a key's cached validation, locally and in Redis.
+    
+    Call whenever a key is deleted or its is_active flag changes.
+    """
+    key = _cache_key(api_key)
+    with _validation_cache_lock:
+        _validation_cache.pop(key, None)
+    if redis_conn.redis_available:
+        try:
+            await redis_conn.redis_client.delete(_redis_key(key))
+        except Exception as e:
+            logger.warning("Redis error in invalidate_api_key: %s", e)
+
+
+def hash_api_key(api_key: str) -> int:
+    """
+    Return the value stored in ApiKey.key_hash for a raw API key.
+    
+    HMAC-SHA256 peppered with SECRET_KEY, truncated to a signed 64-bit int
+    so the unique index is a fixed-width BIGINT rather than a string.
+    """
+    digest = hmac.new(settings.SECRET_KEY.encode(), api_key.encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def _invalid_key() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid API key",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def _lookup_user(api_key: str):
+    """Resolve an API key to user info, or None if the key is invalid."""
+    # TODO: Query database for valid API keys
+    # (ApiKey.key_hash == hash_api_key(api_key) AND is_active)
+    # For now, return mock user based on key prefix
+    match = _PREFIX_RE.match(api_key)
+    if match is None:
+        return None
+    return TIER_INFO[match.group()]
+
+
+async def _resolve_user(key: bytes, api_key: str):
+    """Resolve a key past the local cache: Redis first, then the lookup."""
+    hit, user = await _redis_get(key)
+    if not hit:
+        user = _lookup_user(api_key)
+        await _redis_set(key, user, _ttl_for(user))
+    _cache_set(key, user, _ttl_for(user))
+    return user
+
+
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> dict:
     """
     Validate API key and return user info.
     
     For MVP: simplified validation. In production, query database.
+    Results are cached per key (in-process, then Redis) for
+    VALIDATION_CACHE_TTL seconds; invalid keys for INVALID_KEY_CACHE_TTL.
     """
     api_key = credentials.credentials
+    key = _cache_key(api_key)
     
-    # TODO: Query database for valid API keys
-    # For now, return mock user based on key prefix
-    if api_key.startswith("kzb_free_"):
-        return {
-            "id": "user_free",
-            "tier": "free",
-            "requests_limit": settings.RATE_LIMIT_FREE,
-            "docs_limit": settings.DOC_LIMIT_FREE,
-        }
-    elif api_key.startswith("kzb_hobby_"):
-        return {
-            "id": "user_hobby",
-            "tier": "hobby",
-            "requests_limit": settings.RATE_LIMIT_HOBBY,
-            "docs_limit": settings.DOC_LIMIT_HOBBY,
-        }
-    elif api_key.startswith("kzb_pro_"):
-        return {
-            "id": "user_pro",
-            "tier": "pro",
-            "requests_limit": settings.RATE_LIMIT_PRO,
-            "docs_limit": settings.DOC_LIMIT_PRO,
-        }
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API key",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    hit, user = _cache_get(key)
+    if not hit:
+        user = await _resolve_user(key, api_key)
+    
+    if user is None:
+        raise _invalid_key()
+    
+    # Callers (e.g. rate_limit) annotate the dict, so hand out a copy
+    return dict(user)
@@ -1,5 +1,9 @@
 """Configuration settings."""
 
+import sys
+from functools import lru_cache
+from types import MappingProxyType
+
 from pydantic_settings import BaseSettings
 
 
@@ -8,9 +12,12 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "postgresql://kazuba:kazuba@db:5432/kazuba_saas"
+    # Create tables with create_all at startup (local dev only; use Alembic otherwise)
+    DEV_AUTO_CREATE: bool = False
     
     # Redis
     REDIS_URL: str = "redis://redis:6379"
+    REDIS_MAX_CONN: int = 50
     
     # Security
     SECRET_KEY: str = "change-me-in-production"
@@ -34,8 +41,30 @@ class Settings(BaseSettings):
     DOC_LIMIT_HOBBY: int = 5000
     DOC_LIMIT_PRO: int = 50000
     
+    # Upload size limits (bytes per file)
+    UPLOAD_LIMIT_FREE: int = 5_000_000
+    UPLOAD_LIMIT_HOBBY: int = 25_000_000
+    UPLOAD_LIMIT_PRO: int = 100_000_000
+    
     class Config:
         env_file = ".env"
 
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    """Return the process-wide Settings instance."""
+    return Settings()
+
+
+settings = get_settings()
+
+# Per-tier limits, built once; tier names are interned so lookups on them
+# short-circuit on identity
+TIERS = MappingProxyType({
+    sys.intern(tier): MappingProxyType({"requests_limit": requests_limit, "docs_limit": docs_limit})
+    for tier, requests_limit, docs_limit in (
+        ("free", settings.RATE_LIMIT_FREE, settings.DOC_LIMIT_FREE),
+        ("hobby", settings.RATE_LIMIT_HOBBY, settings.DOC_LIMIT_HOBBY),
+        ("pro", settings.RATE_LIMIT_PRO, settings.DOC_LIMIT_PRO),
+    )
+})
@@ -1,11 +1,23 @@
 """Document conversion module - Kazuba Converter Integration."""
 
+import asyncio
 import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from fastapi import UploadFile, File, HTTPException
 from typing import Optional
 
+from app.config import settings
+
 
 # Try to import optional dependencies
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
 try:
     import pypdf
     PYPDF_AVAILABLE = True
@@ -14,6 +26,23 @@ except ImportError:
 
 try:
     from docx import Document
+    from docx.oxml.ns import nsmap, qn
+    from lxml import etree
+    # Body and table-cell paragraphs in document order; text boxes
+    # (w:txbxContent, in both mc:AlternateContent branches) aren't body text
+    DOCX_PARAGRAPHS = etree.XPath(
+        "./w:p | ./w:tbl//w:tc/w:p[not(ancestor::w:txbxContent)]",
+        namespaces={"w": nsmap["w"]},
+    )
+    # A paragraph's own run content, as Paragraph.text reads it
+    DOCX_RUN_CONTENT = etree.XPath(
+        "./w:r/* | ./w:hyperlink/w:r/*", namespaces={"w": nsmap["w"]}
+    )
+    W_T = qn("w:t")
+    W_TAB = qn("w:tab")
+    W_BR = qn("w:br")
+    W_CR = qn("w:cr")
+    W_TYPE = qn("w:type")
     DOCX_AVAILABLE = True
 except ImportError:
     DOCX_AVAILABLE = False
@@ -25,27 +54,113 @@ ALLOWED_TYPES = {
     "text/plain": "txt",
     "text/markdown": "md",
 }
+ALLOWED_TYPES_SET = frozenset(ALLOWED_TYPES)
+ALLOWED_TYPES_STR = ", ".join(ALLOWED_TYPES)
+
+MAX_BYTES_BY_TIER = {
+    "free": settings.UPLOAD_LIMIT_FREE,
+    "hobby": settings.UPLOAD_LIMIT_HOBBY,
+    "pro": settings.UPLOAD_LIMIT_PRO,
+}
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# PDF/DOCX extraction is pure-Python and GIL-bound, so larger files are
+# parsed in worker processes; below this size the IPC cost isn't worth it.
+PROCESS_POOL_MIN_BYTES = 64 * 1024
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared extraction process pool, creating it on first use."""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """Stop the extraction workers, if the pool was ever started."""
+    global _process_pool
+    pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def _run_extractor(extractor, file_bytes: bytes):
+    """
+    Run an extractor inside a worker process.
+    
+    HTTPException can't be pickled back to the parent, so errors are
+    returned as (status_code, detail) instead of raised.
+    """
+    try:
+        return extractor(file_bytes), None
+    except HTTPException as e:
+        return None, (e.status_code, e.detail)
+
+
+async def _extract_offloaded(extractor, file_bytes: bytes) -> str:
+    """Run a CPU-bound extractor in the process pool for large files."""
+    if len(file_bytes) < PROCESS_POOL_MIN_BYTES:
+        return extractor(file_bytes)
+    
+    global _process_pool
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        text, error = await loop.run_in_executor(pool, _run_extractor, extractor, file_bytes)
+    except BrokenProcessPool:
+        # A worker died (parser crash, OOM kill); the pool can't be reused,
+        # so drop it and let the next request start a fresh one
+        if _process_pool is pool:
+            _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise HTTPException(
+            status_code=422,
+            detail="Failed to extract text: the document crashed the parser."
+        )
+    if error is not None:
+        raise HTTPException(status_code=error[0], detail=error[1])
+    return text
+
+
+def _extract_pdf_pdfium(file_bytes: bytes) -> str:
+    """Extract text from PDF using PDFium (native, preferred)."""
+    pdf = pdfium.PdfDocument(file_bytes)
+    try:
+        text = "\n\n".join(
+            filter(None, (page.get_textpage().get_text_range() for page in pdf))
+        )
+    finally:
+        pdf.close()
+    # PDFium breaks lines with CRLF; match pypdf's LF output
+    return text.replace("\r\n", "\n")
+
+
+def _extract_pdf_pypdf(file_bytes: bytes) -> str:
+    """Extract text from PDF using pypdf (pure-Python fallback)."""
+    reader = pypdf.PdfReader(io.BytesIO(file_bytes))
+    return "\n\n".join(
+        filter(None, (page.extract_text() for page in reader.pages))
+    )
 
 
 def extract_text_from_pdf(file_bytes: bytes) -> str:
-    """Extract text from PDF using pypdf."""
-    if not PYPDF_AVAILABLE:
+    """Extract text from PDF using pypdfium2, falling back to pypdf."""
+    if PDFIUM_AVAILABLE:
+        extractor = _extract_pdf_pdfium
+    elif PYPDF_AVAILABLE:
+        extractor = _extract_pdf_pypdf
+    else:
         raise HTTPException(
             status_code=503,
-            detail="PDF processing not available. Install pypdf: pip install pypdf"
+            detail="PDF processing not available. Install pypdfium2: pip install pypdfium2"
         )
     
     try:
-        pdf_file = io.BytesIO(file_bytes)
-        reader = pypdf.PdfReader(pdf_file)
-        text_parts = []
-        
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                text_parts.append(text)
-        
-        return "\n\n".join(text_parts)
+        return extractor(file_bytes)
     except Exception as e:
         raise HTTPException(
             status_code=400,
@@ -53,6 +168,18 @@ def extract_text_from_pdf(file_bytes: bytes) -> str:
         )
 
 
+def _docx_run_text(el) -> str:
+    """Text for one run child, as Paragraph.text renders it."""
+    tag = el.tag
+    if tag == W_T:
+        return el.text or ""
+    if tag == W_TAB:
+        return "\t"
+    if tag == W_CR or (tag == W_BR and el.get(W_TYPE, "textWrapping") == "textWrapping"):
+        return "\n"
+    return ""  # run properties, drawings, page/column breaks
+
+
 def extract_text_from_docx(file_bytes: bytes) -> str:
     """Extract text from DOCX using python-docx."""
     if not DOCX_AVAILABLE:
@@ -64,13 +191,12 @@ def extract_text_from_docx(file_bytes: bytes) -> str:
     try:
         docx_file = io.BytesIO(file_bytes)
         doc = Document(docx_file)
-        text_parts = []
-        
-        for para in doc.paragraphs:
-            if para.text.strip():
-                text_parts.append(para.text)
-        
-        return "\n\n".join(text_parts)
+        # Walk the XML directly rather than building Paragraph/Run wrappers
+        paragraphs = (
+            "".join(map(_docx_run_text, DOCX_RUN_CONTENT(p)))
+            for p in DOCX_PARAGRAPHS(doc.element.body)
+        )
+        return "\n\n".join(text for text in paragraphs if text.strip())
     except Exception as e:
         raise HTTPException(
             status_code=400,
@@ -81,23 +207,17 @@ def extract_text_from_docx(file_bytes: bytes) -> str:
 def extract_text_from_txt(file_bytes: bytes) -> str:
     """Extract text from plain text file."""
     try:
-        # Try UTF-8 first
+        # Fast path: valid UTF-8
         return file_bytes.decode('utf-8')
     except UnicodeDecodeError:
-        try:
-            # Fallback to latin-1
-            return file_bytes.decode('latin-1')
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to decode text file: {str(e)}"
-            )
+        # Keep valid UTF-8 intact and replace only the bad bytes (U+FFFD)
+        return file_bytes.decode('utf-8', errors='replace')
 
 
 def convert_to_markdown(text: str, filename: str) -> str:
     """Convert extracted text to markdown format."""
-    # Add metadata header
-    markdown = f"""# {filename}
+    # Single f-string so the wrapped document is built in one allocation
+    return f"""# {filename}
 
 ---
 
@@ -107,18 +227,18 @@ def convert_to_markdown(text: str, filename: str) -> str:
 
 *Converted by Kazuba Converter*
 """
-    return markdown
 
 
 async def convert_document(
     file: UploadFile = File(...),
-    output_format: str = "markdown"
+    output_format: str = "markdown",
+    user_tier: str = "free",
 ) -> dict:
     """
     Convert uploaded document to structured format.
     
     Supports:
-    - PDF (.pdf) - requires pypdf
+    - PDF (.pdf) - requires pypdfium2 or pypdf
     - Word (.docx) - requires python-docx  
     - Text (.txt)
     - Markdown (.md)
@@ -126,39 +246,55 @@ async def convert_document(
     Args:
         file: Uploaded file
         output_format: Desired output format (default: markdown)
+        user_tier: Tier of the requesting user, selects the upload size cap
     
     Returns:
         dict with conversion results including extracted text
     """
     # Validate file type
-    if file.content_type not in ALLOWED_TYPES:
+    if file.content_type not in ALLOWED_TYPES_SET:
         raise HTTPException(
             status_code=400,
             detail=f"Unsupported file type: {file.content_type}. "
-                   f"Supported types: {', '.join(ALLOWED_TYPES.keys())}"
+                   f"Supported types: {ALLOWED_TYPES_STR}"
         )
     
-    # Read file content
+    # Read file content in chunks, failing fast once the tier cap is exceeded
+    limit = MAX_BYTES_BY_TIER.get(user_tier, MAX_BYTES_BY_TIER["free"])
+    buf = io.BytesIO()
+    total = 0
     try:
-        file_bytes = await file.read()
-        if len(file_bytes) == 0:
-            raise HTTPException(
-                status_code=400,
-                detail="Empty file uploaded"
-            )
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            total += len(chunk)
+            if total > limit:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large for your tier. Limit: {limit} bytes."
+                )
+            buf.write(chunk)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=400,
             detail=f"Failed to read file: {str(e)}"
         )
     
+    if total == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Empty file uploaded"
+        )
+    file_bytes = buf.getvalue()
+    del buf
+    
     # Extract text based on file type
     file_type = ALLOWED_TYPES[file.content_type]
     
     if file_type == "pdf":
-        extracted_text = extract_text_from_pdf(file_bytes)
+        extracted_text = await _extract_offloaded(extract_text_from_pdf, file_bytes)
     elif file_type == "docx":
-        extracted_text = extract_text_from_docx(file_bytes)
+        extracted_text = await _extract_offloaded(extract_text_from_docx, file_bytes)
     elif file_type in ("txt", "md"):
         extracted_text = extract_text_from_txt(file_bytes)
     else:
@@ -167,9 +303,15 @@ async def convert_document(
             detail=f"Unsupported file type: {file.content_type}"
         )
     
+    # Release the upload and record the text length up front so at most
+    # the text and its markdown copy are alive at once (then just the copy)
+    del file_bytes
+    extracted_text_length = len(extracted_text)
+    
     # Convert to requested format
     if output_format == "markdown":
         content = convert_to_markdown(extracted_text, file.filename)
+        del extracted_text
     elif output_format == "text":
         content = extracted_text
     else:
@@ -187,5 +329,5 @@ async def convert_document(
         "status": "converted",
         "content": content,
         "content_length": len(content),
-        "extracted_text_length": len(extracted_text),
+        "extracted_text_length": extracted_text_length,
     }
@@ -1,21 +1,80 @@
 """Database configuration."""
 
-from sqlalchemy import create_engine
+import asyncio
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Map sync driver URLs onto their asyncio drivers
+ASYNC_DRIVERS = {
+    "postgres://": "postgresql+asyncpg://",  # Heroku/Render-style URLs
+    "postgresql://": "postgresql+asyncpg://",
+    "postgresql+psycopg2://": "postgresql+asyncpg://",
+    "sqlite://": "sqlite+aiosqlite://",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Return the asyncio-driver equivalent of a database URL."""
+    for prefix, async_prefix in ASYNC_DRIVERS.items():
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+
+engine = create_async_engine(to_async_url(settings.DATABASE_URL))
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
 
-def get_db():
+async def get_db():
     """Dependency to get database session."""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+# Health-check ping result cache: (checked_at, ok)
+DB_PING_TTL = 5
+DB_PING_TIMEOUT = 1  # seconds; a probe must not wait on asyncpg's 60s connect
+_last_ping = (0.0, False)
+# One ping in flight at a time; concurrent probes wait and reuse its result
+_ping_lock = asyncio.Lock()
+
+
+def _cached_ping(now: float):
+    """Return the cached ping result if still fresh, else None."""
+    checked_at, ok = _last_ping
+    if checked_at and now - checked_at < DB_PING_TTL:
+        return ok
+    return None
+
+
+async def _select_one() -> None:
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def ping_database() -> bool:
+    """Return whether the database answers SELECT 1, cached for DB_PING_TTL seconds."""
+    global _last_ping
+    ok = _cached_ping(time.monotonic())
+    if ok is not None:
+        return ok
+    
+    async with _ping_lock:
+        now = time.monotonic()
+        ok = _cached_ping(now)
+        if ok is not None:
+            return ok
+        try:
+            await asyncio.wait_for(_select_one(), DB_PING_TIMEOUT)
+            ok = True
+        except Exception:
+            ok = False
+        _last_ping = (now, ok)
+    return ok
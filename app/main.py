@@ -3,37 +3,81 @@ Kazuba Converter SaaS API
 FastAPI application with authentication, rate limiting, and Stripe integration.
 """
 
-import time
+import asyncio
+import logging
 import os
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+import queue
+import re
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+from fastapi import FastAPI, Depends, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response
 
+from app import redis_conn
 from app.config import settings
-from app.database import engine, Base
+from app.database import engine, Base, ping_database
 from app.auth import get_current_user
 from app.stripe_routes import router as stripe_router
-from app.convert import convert_document
-
-# Create tables with retry logic for Railway deploy
-def init_db(max_retries=5, delay=2):
-    """Initialize database with retry logic for cloud deployments."""
-    for attempt in range(max_retries):
-        try:
-            Base.metadata.create_all(bind=engine)
-            print("✅ Database initialized successfully")
-            return True
-        except Exception as e:
-            print(f"⚠️  DB connection attempt {attempt + 1}/{max_retries} failed: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(delay)
-            else:
-                print("❌ Failed to connect to database after all retries")
-                return False
-
-# Initialize DB (but don't block startup)
-db_ready = init_db()
+from app.convert import convert_document, shutdown_process_pool
+from app.rate_limit import rate_limit, read_usage
+from app.usage_flusher import flush_usage_buffer, record_usage, run_usage_flusher
+
+logger = logging.getLogger(__name__)
+
+
+def start_log_listener() -> tuple:
+    """
+    Route "app.*" logs through a queue so handler I/O runs on a
+    background thread instead of the request path.
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    listener = QueueListener(log_queue, stream_handler)
+    queue_handler = QueueHandler(log_queue)
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(logging.INFO)
+    app_logger.addHandler(queue_handler)
+    listener.start()
+    return listener, queue_handler
+
+
+def stop_log_listener(listener: QueueListener, queue_handler: QueueHandler) -> None:
+    """Detach the queue handler and flush pending records."""
+    logging.getLogger("app").removeHandler(queue_handler)
+    listener.stop()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    listener, queue_handler = start_log_listener()
+    await redis_conn.check_redis()
+    # Schema is managed by Alembic; create_all is only a local-dev shortcut
+    if settings.DEV_AUTO_CREATE:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    flusher = asyncio.create_task(run_usage_flusher())
+    yield
+    flusher.cancel()
+    try:
+        await flusher
+    except asyncio.CancelledError:
+        pass
+    try:
+        await flush_usage_buffer()
+    except Exception as e:
+        logger.warning("Final usage flush failed: %s", e)
+    shutdown_process_pool()
+    await engine.dispose()
+    await redis_conn.redis_pool.disconnect()
+    stop_log_listener(listener, queue_handler)
+
 
 app = FastAPI(
     title="Kazuba Converter SaaS API",
@@ -41,15 +85,76 @@ app = FastAPI(
     version="0.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Include Stripe routes
 app.include_router(stripe_router)
 
+LANDING_CACHE_CONTROL = "public, max-age=3600"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Content-hashed asset names, e.g. app.3f9a1c2b.js
+_HASHED_ASSET_RE = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that adds Cache-Control so edge caches can serve assets."""
+    
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if _HASHED_ASSET_RE.search(str(full_path)):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = LANDING_CACHE_CONTROL
+        return response
+
+
 # Mount static files (landing page)
 landing_path = os.path.join(os.path.dirname(__file__), "..", "landing")
 if os.path.exists(landing_path):
-    app.mount("/static", StaticFiles(directory=landing_path), name="static")
+    app.mount("/static", CachedStaticFiles(directory=landing_path, html=True), name="static")
+
+# Resolved once at startup so "/" doesn't stat the filesystem per request
+landing_file = os.path.join(landing_path, "index.html")
+LANDING_FILE = landing_file if os.path.exists(landing_file) else None
+
+API_INFO = {
+    "name": "Kazuba Converter SaaS API",
+    "version": "0.1.0",
+    "docs": "/docs",
+    "pricing": {
+        "free": {"requests_per_day": 50, "docs_per_month": 100},
+        "hobby": {"price": "R$ 29/mês", "requests_per_day": 500, "docs_per_month": 5000},
+        "pro": {"price": "R$ 149/mês", "requests_per_day": 5000, "docs_per_month": 50000},
+    }
+}
+API_INFO_JSON = orjson.dumps(API_INFO)
+
+FORMATS_RESPONSE = {
+    "input_formats": [
+        {"type": "application/pdf", "extension": ".pdf", "description": "PDF documents"},
+        {"type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "extension": ".docx", "description": "Microsoft Word documents"},
+        {"type": "text/plain", "extension": ".txt", "description": "Plain text files"},
+        {"type": "text/markdown", "extension": ".md", "description": "Markdown files"},
+    ],
+    "output_formats": [
+        {"format": "markdown", "description": "Markdown with metadata header"},
+        {"format": "text", "description": "Plain text extraction"},
+    ]
+}
+FORMATS_RESPONSE_JSON = orjson.dumps(FORMATS_RESPONSE)
+
+# /health has only two possible bodies, keyed by the DB ping result
+HEALTH_JSON = {
+    ok: orjson.dumps({
+        "status": "healthy",
+        "database": "connected" if ok else "disconnected",
+        "version": "0.1.0",
+    })
+    for ok in (True, False)
+}
 
 # CORS
 app.add_middleware(
@@ -64,30 +169,16 @@ app.add_middleware(
 @app.get("/")
 async def root():
     """Serve landing page if available, otherwise return API info."""
-    landing_file = os.path.join(landing_path, "index.html")
-    if os.path.exists(landing_file):
-        return FileResponse(landing_file)
+    if LANDING_FILE:
+        return FileResponse(LANDING_FILE, headers={"Cache-Control": LANDING_CACHE_CONTROL})
     
-    return {
-        "name": "Kazuba Converter SaaS API",
-        "version": "0.1.0",
-        "docs": "/docs",
-        "pricing": {
-            "free": {"requests_per_day": 50, "docs_per_month": 100},
-            "hobby": {"price": "R$ 29/mês", "requests_per_day": 500, "docs_per_month": 5000},
-            "pro": {"price": "R$ 149/mês", "requests_per_day": 5000, "docs_per_month": 50000},
-        }
-    }
+    return Response(content=API_INFO_JSON, media_type="application/json")
 
 
-@app.get("/health")
+@app.get("/health", response_class=Response)
 async def health_check():
     """Health check endpoint for monitoring."""
-    return {
-        "status": "healthy",
-        "database": "connected" if db_ready else "disconnected",
-        "version": "0.1.0"
-    }
+    return Response(content=HEALTH_JSON[await ping_database()], media_type="application/json")
 
 
 @app.post("/convert")
@@ -107,14 +198,12 @@ async def convert(
     Returns converted document content.
     """
     # Apply rate limiting
-    from app.rate_limit import rate_limit
-    try:
-        rate_limit(user)
-    except HTTPException:
-        raise
+    await rate_limit(user)
     
     # Convert document
-    result = await convert_document(file, output_format)
+    result = await convert_document(file, output_format, user.get("tier", "free"))
+    # Only successful conversions reach usage_logs
+    await record_usage(user, "/convert")
     
     # Add user info to response
     result["user_tier"] = user.get("tier", "free")
@@ -128,6 +217,7 @@ async def get_usage(
     user: dict = Depends(get_current_user)
 ):
     """Get current usage statistics for the authenticated user."""
+    user = {**user, **await read_usage(user)}
     return {
         "tier": user.get("tier", "free"),
         "requests_today": user.get("requests_today", 0),
@@ -138,18 +228,7 @@ async def get_usage(
     }
 
 
-@app.get("/formats")
+@app.get("/formats", response_class=Response)
 async def get_supported_formats():
     """Get list of supported input and output formats."""
-    return {
-        "input_formats": [
-            {"type": "application/pdf", "extension": ".pdf", "description": "PDF documents"},
-            {"type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "extension": ".docx", "description": "Microsoft Word documents"},
-            {"type": "text/plain", "extension": ".txt", "description": "Plain text files"},
-            {"type": "text/markdown", "extension": ".md", "description": "Markdown files"},
-        ],
-        "output_formats": [
-            {"format": "markdown", "description": "Markdown with metadata header"},
-            {"format": "text", "description": "Plain text extraction"},
-        ]
-    }
+    return Response(content=FORMATS_RESPONSE_JSON, media_type="application/json")
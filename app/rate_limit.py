@@ -1,75 +1,158 @@
 """Rate limiting middleware."""
 
-import redis
+import hashlib
+import logging
+import math
+import time
+import uuid
+
 from fastapi import HTTPException, status
+from redis.exceptions import NoScriptError
+
+from app import redis_conn
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_WINDOW = 86400  # 24 hours
+RATE_LIMIT_WINDOW_MS = RATE_LIMIT_WINDOW * 1000
+USAGE_TTL_MS = 32 * 86400 * 1000  # monthly usage hash outlives its month
+
+# Sliding-window log in one round-trip: drop entries older than the window,
+# count, then admit (ZADD) or reject with the oldest entry's timestamp.
+# Monthly usage is counted separately, after a successful conversion, by
+# app.usage_flusher.record_usage.
+# KEYS[1] = sorted set key
+# ARGV = now (ms), window (ms), limit, unique member
+# Returns {count, 0} when admitted, {-1, oldest_ms} when over the limit.
+RATE_LIMIT_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+local c = redis.call('ZCARD', KEYS[1])
+if c >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {-1, tonumber(oldest[2])}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window + 60000)
+return {c + 1, 0}
+"""
+RATE_LIMIT_SHA = hashlib.sha1(RATE_LIMIT_LUA.encode()).hexdigest()
+
+# Read-only view for /usage: requests still inside the window and this
+# month's count of successful requests to one endpoint.
+# KEYS[1] = sorted set key, KEYS[2] = monthly usage hash
+# ARGV = now (ms), window (ms), endpoint
+# Returns {count, month_count}
+USAGE_LUA = """
+local c = redis.call('ZCOUNT', KEYS[1], '(' .. (tonumber(ARGV[1]) - tonumber(ARGV[2])), '+inf')
+local m = redis.call('HGET', KEYS[2], ARGV[3])
+return {c, tonumber(m) or 0}
+"""
+USAGE_SHA = hashlib.sha1(USAGE_LUA.encode()).hexdigest()
+
+
+async def _run_script(script: str, sha: str, keys: tuple, args: tuple):
+    """Run a Lua script by SHA, loading it on NOSCRIPT."""
+    try:
+        return await redis_conn.redis_client.evalsha(sha, len(keys), *keys, *args)
+    except NoScriptError:
+        return await redis_conn.redis_client.eval(script, len(keys), *keys, *args)
+
+
+def _rate_limit_key(user_id) -> str:
+    return f"rate_limit:{user_id}"
 
-from app.config import settings
 
-# Redis connection with error handling
-try:
-    redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-    redis_client.ping()
-    redis_available = True
-except Exception as e:
-    print(f"⚠️  Redis not available: {e}")
-    redis_client = None
-    redis_available = False
+def monthly_usage_key(user_id, now: float) -> str:
+    """Redis hash of endpoint -> successful requests this month, usage:{user_id}:{YYYY-MM}."""
+    return f"usage:{user_id}:{time.strftime('%Y-%m', time.gmtime(now))}"
 
 
-def rate_limit(user: dict = None) -> None:
+def _allow_without_limit(user: dict) -> None:
+    """Annotate the user for a request admitted without a Redis check."""
+    user["requests_today"] = 0
+    user["requests_remaining"] = user.get("requests_limit", 50)
+
+
+async def rate_limit(user: dict = None) -> None:
     """
     Check and update rate limit for user.
     
-    Uses Redis to track requests per day.
-    Falls back to in-memory tracking if Redis is unavailable.
+    Uses a Redis sorted set as a sliding 24h window of request timestamps.
+    Skips limiting (allows the request) if Redis is unavailable.
     """
     if user is None:
         return
     
     # If Redis unavailable, skip rate limiting (log warning)
-    if not redis_available or redis_client is None:
-        user["requests_today"] = 0
-        user["requests_remaining"] = user.get("requests_limit", 50)
+    if not redis_conn.redis_available:
+        _allow_without_limit(user)
         return
     
     user_id = user.get("id", "anonymous")
-    tier = user.get("tier", "free")
     limit = user.get("requests_limit", 50)
     
-    # Redis key: rate_limit:{user_id}:{YYYY-MM-DD}
-    from datetime import date
-    today = date.today().isoformat()
-    key = f"rate_limit:{user_id}:{today}"
+    now = time.time()
+    now_ms = int(now * 1000)
+    keys = (_rate_limit_key(user_id),)
+    args = (now_ms, RATE_LIMIT_WINDOW_MS, limit, uuid.uuid4().hex)
     
     try:
-        # Get current count
-        current = redis_client.get(key)
-        if current is None:
-            current = 0
-        else:
-            current = int(current)
-        
-        # Check limit
-        if current >= limit:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"Rate limit exceeded. Limit: {limit} requests per day.",
-                headers={"Retry-After": "86400"},
-            )
-        
-        # Increment counter
-        pipe = redis_client.pipeline()
-        pipe.incr(key)
-        pipe.expire(key, 86400)  # 24 hours
-        pipe.execute()
-        
-        # Update user dict with remaining requests
-        user["requests_today"] = current + 1
-        user["requests_remaining"] = limit - (current + 1)
-    except HTTPException:
-        raise
+        current, oldest_ms = await _run_script(
+            RATE_LIMIT_LUA, RATE_LIMIT_SHA, keys, args
+        )
+        current = int(current)
     except Exception as e:
         # Redis error - log and allow request
-        print(f"⚠️  Redis error in rate_limit: {e}")
-        user["requests_today"] = 0
-        user["requests_remaining"] = user.get("requests_limit", 50)
+        logger.warning("Redis error in rate_limit: %s", e)
+        _allow_without_limit(user)
+        return
+    
+    if current == -1:
+        # Retry once the oldest request in the window expires
+        retry_after = max(1, math.ceil((int(oldest_ms) + RATE_LIMIT_WINDOW_MS - now_ms) / 1000))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded. Limit: {limit} requests per day.",
+            headers={"Retry-After": str(retry_after)},
+        )
+    
+    # Update user dict with remaining requests
+    user["requests_today"] = current
+    user["requests_remaining"] = limit - current
+
+
+async def read_usage(user: dict, endpoint: str = "/convert") -> dict:
+    """
+    Return the user's current requests_today, requests_remaining and
+    docs_this_month from Redis without counting a request.
+    
+    requests_today counts admitted requests, including ones whose
+    conversion then failed; docs_this_month counts successful conversions.
+    
+    Returns an empty dict if Redis is unavailable or errors.
+    """
+    if not redis_conn.redis_available:
+        return {}
+    
+    user_id = user.get("id", "anonymous")
+    now = time.time()
+    limit = user.get("requests_limit", 50)
+    try:
+        current, month_count = await _run_script(
+            USAGE_LUA,
+            USAGE_SHA,
+            (_rate_limit_key(user_id), monthly_usage_key(user_id, now)),
+            (int(now * 1000), RATE_LIMIT_WINDOW_MS, endpoint),
+        )
+    except Exception as e:
+        logger.warning("Redis error in read_usage: %s", e)
+        return {}
+    
+    current = int(current)
+    return {
+        "requests_today": current,
+        "requests_remaining": max(0, limit - current),
+        "docs_this_month": int(month_count),
+    }
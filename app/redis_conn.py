@@ -0,0 +1,39 @@
+"""Shared Redis connection."""
+
+import logging
+
+import redis.asyncio as aioredis
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bounded, shared pool: caps sockets per worker and keeps connections alive.
+# Replies stay raw bytes; the hot path reads integers from Lua and decodes
+# strings only where it needs them.
+redis_pool = aioredis.ConnectionPool.from_url(
+    settings.REDIS_URL,
+    max_connections=settings.REDIS_MAX_CONN,
+    decode_responses=False,
+    socket_keepalive=True,
+    socket_timeout=0.2,
+    socket_connect_timeout=0.5,
+    health_check_interval=30,
+    retry_on_timeout=True,
+)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+
+# Set by check_redis() at startup; callers skip Redis while it is False
+redis_available = False
+
+
+async def check_redis() -> bool:
+    """Ping Redis and record whether it is reachable."""
+    global redis_available
+    try:
+        await redis_client.ping()
+        redis_available = True
+    except Exception as e:
+        logger.warning("Redis not available: %s", e)
+        redis_available = False
+    return redis_available
@@ -1,15 +1,93 @@
 """Stripe integration for payments and subscriptions."""
 
+import hashlib
+import hmac
+import logging
+import time
+
+import orjson
 import stripe
 from fastapi import APIRouter, HTTPException, status, Request, Header
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 
 from app.config import settings
 
-router = APIRouter(prefix="/stripe", tags=["payments"])
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/stripe", tags=["payments"], default_response_class=ORJSONResponse)
 
-# Configure Stripe
+# Configure Stripe; a shared RequestsClient keeps a pooled keep-alive
+# session instead of a new TLS handshake per API call
 stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.default_http_client = stripe.http_client.RequestsClient(timeout=10)
+
+PRICE_MAP = {
+    "hobby": settings.STRIPE_PRICE_HOBBY,
+    "pro": settings.STRIPE_PRICE_PRO,
+}
+LINE_ITEMS = {
+    tier: [{"price": price_id, "quantity": 1}]
+    for tier, price_id in PRICE_MAP.items()
+}
+SUCCESS_URL = f"{settings.FRONTEND_URL}/success?session_id={{CHECKOUT_SESSION_ID}}"
+CANCEL_URL = f"{settings.FRONTEND_URL}/cancel"
+
+# Public config depends only on settings, so it is serialized once
+STRIPE_CONFIG_JSON = orjson.dumps({
+    "publishable_key": settings.STRIPE_SECRET_KEY[:7] + "..." if settings.STRIPE_SECRET_KEY else None,
+    "prices": {
+        "hobby": settings.STRIPE_PRICE_HOBBY or None,
+        "pro": settings.STRIPE_PRICE_PRO or None,
+    }
+})
+
+# Keyed HMAC prototype for webhook signatures; .copy() per request skips
+# re-deriving the key schedule. None when no real secret is configured.
+WEBHOOK_TOLERANCE = stripe.Webhook.DEFAULT_TOLERANCE
+if settings.STRIPE_WEBHOOK_SECRET and "placeholder" not in settings.STRIPE_WEBHOOK_SECRET:
+    WEBHOOK_HMAC = hmac.new(settings.STRIPE_WEBHOOK_SECRET.encode(), digestmod=hashlib.sha256)
+else:
+    WEBHOOK_HMAC = None
+
+
+def verify_webhook_signature(payload: bytes, sig_header: str) -> None:
+    """
+    Verify a Stripe-Signature header ("t=...,v1=...") against WEBHOOK_HMAC.
+    
+    Raises stripe.error.SignatureVerificationError on any mismatch.
+    """
+    timestamp = None
+    signatures = []
+    for item in (sig_header or "").split(","):
+        name, _, value = item.partition("=")
+        if name == "t":
+            timestamp = value
+        elif name == "v1":
+            signatures.append(value)
+    
+    if timestamp is None or not signatures:
+        raise stripe.error.SignatureVerificationError(
+            "Unable to extract timestamp and signatures from header", sig_header, payload
+        )
+    
+    mac = WEBHOOK_HMAC.copy()
+    mac.update(timestamp.encode())
+    mac.update(b".")
+    mac.update(payload)
+    expected = mac.hexdigest()
+    if not any(hmac.compare_digest(expected, sig) for sig in signatures):
+        raise stripe.error.SignatureVerificationError(
+            "No signatures found matching the expected signature for payload", sig_header, payload
+        )
+    
+    try:
+        too_old = int(timestamp) < time.time() - WEBHOOK_TOLERANCE
+    except ValueError:
+        too_old = True
+    if too_old:
+        raise stripe.error.SignatureVerificationError(
+            "Timestamp outside the tolerance zone", sig_header, payload
+        )
 
 
 @router.post("/create-checkout-session")
@@ -21,12 +99,7 @@ async def create_checkout_session(tier: str = "hobby"):
             detail="Stripe not configured"
         )
     
-    price_map = {
-        "hobby": settings.STRIPE_PRICE_HOBBY,
-        "pro": settings.STRIPE_PRICE_PRO,
-    }
-    
-    price_id = price_map.get(tier)
+    price_id = PRICE_MAP.get(tier)
     if not price_id or "placeholder" in price_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -36,13 +109,10 @@ async def create_checkout_session(tier: str = "hobby"):
     try:
         session = stripe.checkout.Session.create(
             payment_method_types=["card"],
-            line_items=[{
-                "price": price_id,
-                "quantity": 1,
-            }],
+            line_items=LINE_ITEMS[tier],
             mode="subscription",
-            success_url=f"{settings.FRONTEND_URL}/success?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{settings.FRONTEND_URL}/cancel",
+            success_url=SUCCESS_URL,
+            cancel_url=CANCEL_URL,
         )
         return {"checkout_url": session.url, "session_id": session.id}
     except stripe.error.StripeError as e:
@@ -52,57 +122,62 @@ async def create_checkout_session(tier: str = "hobby"):
         )
 
 
+async def _on_checkout_completed(session: dict) -> None:
+    logger.info("Checkout completed: %s", session["id"])
+    # TODO: Update user tier in database
+
+
+async def _on_invoice_paid(invoice: dict) -> None:
+    logger.info("Invoice paid: %s", invoice["id"])
+    # TODO: Update subscription status
+
+
+async def _on_payment_failed(invoice: dict) -> None:
+    logger.warning("Payment failed: %s", invoice["id"])
+    # TODO: Notify user and downgrade tier
+
+
+async def _on_subscription_deleted(subscription: dict) -> None:
+    logger.info("Subscription cancelled: %s", subscription["id"])
+    # TODO: Downgrade user to free tier
+
+
+# Event type -> handler for the object in event["data"]["object"]
+WEBHOOK_HANDLERS = {
+    "checkout.session.completed": _on_checkout_completed,
+    "invoice.paid": _on_invoice_paid,
+    "invoice.payment_failed": _on_payment_failed,
+    "customer.subscription.deleted": _on_subscription_deleted,
+}
+
+
 @router.post("/webhook")
 async def stripe_webhook(request: Request, stripe_signature: str = Header(None, alias="Stripe-Signature")):
     """Handle Stripe webhooks for subscription events."""
     if not settings.STRIPE_WEBHOOK_SECRET or "placeholder" in settings.STRIPE_WEBHOOK_SECRET:
         # In development, just log and return success
         payload = await request.body()
-        print(f"⚠️  Stripe webhook received but not configured. Payload: {payload[:200]}...")
+        logger.warning("Stripe webhook received but not configured. Payload: %s...", payload[:200])
         return {"status": "ignored", "reason": "webhook_secret_not_configured"}
     
     payload = await request.body()
     
     try:
-        event = stripe.Webhook.construct_event(
-            payload, stripe_signature, settings.STRIPE_WEBHOOK_SECRET
-        )
+        verify_webhook_signature(payload, stripe_signature)
+        event = orjson.loads(payload)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid payload")
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
     
-    # Handle events
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        print(f"✅ Checkout completed: {session['id']}")
-        # TODO: Update user tier in database
-        
-    elif event["type"] == "invoice.paid":
-        invoice = event["data"]["object"]
-        print(f"✅ Invoice paid: {invoice['id']}")
-        # TODO: Update subscription status
-        
-    elif event["type"] == "invoice.payment_failed":
-        invoice = event["data"]["object"]
-        print(f"❌ Payment failed: {invoice['id']}")
-        # TODO: Notify user and downgrade tier
-        
-    elif event["type"] == "customer.subscription.deleted":
-        subscription = event["data"]["object"]
-        print(f"🗑️  Subscription cancelled: {subscription['id']}")
-        # TODO: Downgrade user to free tier
+    handler = WEBHOOK_HANDLERS.get(event["type"])
+    if handler is not None:
+        await handler(event["data"]["object"])
     
     return {"status": "success"}
 
 
-@router.get("/config")
+@router.get("/config", response_class=Response)
 async def get_stripe_config():
     """Get public Stripe configuration."""
-    return {
-        "publishable_key": settings.STRIPE_SECRET_KEY[:7] + "..." if settings.STRIPE_SECRET_KEY else None,
-        "prices": {
-            "hobby": settings.STRIPE_PRICE_HOBBY if settings.STRIPE_PRICE_HOBBY else None,
-            "pro": settings.STRIPE_PRICE_PRO if settings.STRIPE_PRICE_PRO else None,
-        }
-    }
+    return Response(content=STRIPE_CONFIG_JSON, media_type="application/json")
@@ -0,0 +1,130 @@
+"""Per-request usage counting and its background flush into usage_logs."""
+
+import asyncio
+import logging
+import time
+
+from sqlalchemy import insert
+
+from app import redis_conn
+from app.database import SessionLocal
+from app.rate_limit import USAGE_TTL_MS, monthly_usage_key
+from models import UsageLog
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL = 5  # seconds
+USAGE_FLUSH_BATCH = 1000  # buffer keys popped per SPOP
+USAGE_BUFFER_PREFIX = "usage_buffer:"
+# Set of buffer keys holding counts, so a flush never scans the keyspace
+USAGE_DIRTY_KEY = "usage_buffer_dirty"
+
+# Read and delete a buffer hash in one step so increments landing during
+# the flush go to a fresh hash instead of being lost.
+DRAIN_LUA = """
+local v = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return v
+"""
+
+
+def usage_buffer_key(user_id, api_key_id) -> str:
+    """Redis hash of endpoint -> request count awaiting flush."""
+    return f"{USAGE_BUFFER_PREFIX}{user_id}:{api_key_id}"
+
+
+def _parse_buffer_key(key: bytes):
+    """Return (user_id, api_key_id) as ints, or None for non-DB users."""
+    user_id, _, api_key_id = key[len(USAGE_BUFFER_PREFIX):].rpartition(b":")
+    try:
+        return int(user_id), int(api_key_id)
+    except ValueError:
+        return None
+
+
+async def record_usage(user: dict, endpoint: str) -> None:
+    """
+    Count one successful request in the user's monthly usage hash and, for
+    DB-backed users, buffer it for the next flush.
+    
+    Sets user["docs_this_month"] to the updated monthly count.
+    """
+    if not redis_conn.redis_available:
+        return
+    user_id = user.get("id", "anonymous")
+    month_key = monthly_usage_key(user_id, time.time())
+    try:
+        async with redis_conn.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hincrby(month_key, endpoint, 1)
+            pipe.pexpire(month_key, USAGE_TTL_MS)
+            # Prefix-derived users have no users row to attach logs to
+            if isinstance(user_id, int):
+                key = usage_buffer_key(user_id, user.get("api_key_id", 0))
+                pipe.hincrby(key, endpoint, 1)
+                pipe.sadd(USAGE_DIRTY_KEY, key)
+            month_count = (await pipe.execute())[0]
+    except Exception as e:
+        logger.warning("Redis error in record_usage: %s", e)
+        return
+    user["docs_this_month"] = int(month_count)
+
+
+async def _drain(key: bytes) -> dict:
+    """Atomically take a buffer hash's contents, returning {endpoint: count}."""
+    flat = await redis_conn.redis_client.eval(DRAIN_LUA, 1, key)
+    return {flat[i].decode(): int(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+
+async def flush_usage_buffer() -> int:
+    """
+    Move all buffered usage counts into usage_logs as one batched INSERT.
+    
+    Returns the number of rows written. Counts are pushed back into the
+    buffer if the insert fails.
+    """
+    if not redis_conn.redis_available:
+        return 0
+    
+    # A key popped here and re-added by a concurrent record_usage is just
+    # drained again (possibly empty) on the next flush.
+    drained = {}
+    while keys := await redis_conn.redis_client.spop(USAGE_DIRTY_KEY, USAGE_FLUSH_BATCH):
+        for key in keys:
+            ids = _parse_buffer_key(key)
+            counts = await _drain(key)
+            if ids is not None and counts:
+                drained[key] = (ids, counts)
+    
+    rows = [
+        {"user_id": user_id, "api_key_id": api_key_id, "endpoint": endpoint, "status_code": 200}
+        for (user_id, api_key_id), counts in drained.values()
+        for endpoint, count in counts.items()
+        for _ in range(count)
+    ]
+    if not rows:
+        return 0
+    
+    try:
+        async with SessionLocal() as db:
+            await db.execute(insert(UsageLog), rows)
+            await db.commit()
+    except Exception as e:
+        logger.error("Usage flush failed, re-buffering %d rows: %s", len(rows), e)
+        async with redis_conn.redis_client.pipeline(transaction=True) as pipe:
+            for key, (_, counts) in drained.items():
+                for endpoint, count in counts.items():
+                    pipe.hincrby(key, endpoint, count)
+                pipe.sadd(USAGE_DIRTY_KEY, key)
+            await pipe.execute()
+        return 0
+    return len(rows)
+
+
+async def run_usage_flusher(interval: float = USAGE_FLUSH_INTERVAL) -> None:
+    """Flush the usage buffer every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_usage_buffer()
+        except Exception as e:
+            logger.warning("Usage flush error: %s", e)
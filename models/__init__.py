@@ -1,6 +1,7 @@
 """Database models."""
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Enum
+from sqlalchemy import Column, BigInteger, Integer, SmallInteger, String, DateTime, Boolean, Index, CheckConstraint, ForeignKey, text
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.sql import func
 import enum
 
@@ -14,6 +15,34 @@ class UserTier(str, enum.Enum):
     ENTERPRISE = "enterprise"
 
 
+# Stored codes are persisted data: never renumber, only append
+TIER_CODES = {
+    UserTier.FREE: 0,
+    UserTier.HOBBY: 1,
+    UserTier.PRO: 2,
+    UserTier.ENTERPRISE: 3,
+}
+TIERS_BY_CODE = {code: tier for tier, code in TIER_CODES.items()}
+
+
+class TierType(TypeDecorator):
+    """Store UserTier as a SMALLINT code instead of a string/enum column."""
+    
+    impl = SmallInteger
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        # UserTier is a str enum, so plain strings hit the same dict keys
+        return TIER_CODES[value]
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return TIERS_BY_CODE[value]
+
+
 class User(Base):
     __tablename__ = "users"
     
@@ -21,33 +50,48 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     stripe_customer_id = Column(String, unique=True, nullable=True)
     stripe_subscription_id = Column(String, unique=True, nullable=True)
-    tier = Column(Enum(UserTier), default=UserTier.FREE)
+    tier = Column(TierType, nullable=False, default=UserTier.FREE, server_default="0")
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    __table_args__ = (
+        CheckConstraint(
+            f"tier BETWEEN {min(TIERS_BY_CODE)} AND {max(TIERS_BY_CODE)}",
+            name="ck_user_tier",
+        ),
+    )
 
 
 class ApiKey(Base):
     __tablename__ = "api_keys"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False)
-    key_hash = Column(String, unique=True, nullable=False)
-    key_prefix = Column(String, nullable=False)  # First 8 chars for display
+    user_id = Column(Integer, ForeignKey("users.id", name="fk_api_keys_user_id"), nullable=False)
+    key_hash = Column(BigInteger, unique=True, nullable=False)  # see app.auth.hash_api_key
+    key_prefix = Column(String, nullable=False, index=True)  # First 8 chars for display
     name = Column(String, nullable=True)  # User-defined name
     is_active = Column(Boolean, default=True)
     last_used_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        Index("ix_api_keys_user_active", user_id, postgresql_where=text("is_active = true")),
+    )
 
 
 class UsageLog(Base):
     __tablename__ = "usage_logs"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", name="fk_usage_logs_user_id"), nullable=False)
     api_key_id = Column(Integer, nullable=False)
     endpoint = Column(String, nullable=False)
     status_code = Column(Integer, nullable=False)
     response_time_ms = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index("ix_usage_logs_user_created", user_id, created_at.desc()),
+    )
@@ -1,22 +1,193 @@
 """Conftest for pytest — shared fixtures."""
 
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import fakeredis
+import httpx
 import pytest
-from unittest.mock import Mock, patch
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import pytest_asyncio
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.pool import StaticPool
 
+from app.main import app
+from app.config import TIERS
+from app.database import Base, get_db
+import models  # noqa: F401 — register tables on Base.metadata
+
+
+def pytest_collection_modifyitems(items):
+    """Run every async test on one session-wide event loop."""
+    session_loop = pytest.mark.asyncio(scope="session")
+    for item in items:
+        if pytest_asyncio.is_async_test(item):
+            item.add_marker(session_loop, append=False)
+
+
+@pytest_asyncio.fixture(scope="session")
+async def test_engine():
+    """Create a test database engine (in-memory, so private to each xdist worker)."""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+
+    # pysqlite defers BEGIN itself, which breaks SAVEPOINT rollback in
+    # db_session; let SQLAlchemy emit BEGIN explicitly instead.
+    @event.listens_for(engine.sync_engine, "connect")
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    # In-memory database: disposing the pool discards the schema with it
+    await engine.dispose()
+
+
+@pytest.fixture
+def db_session(test_engine):
+    """
+    AsyncSession whose work is rolled back after each test.
+    
+    pytest-asyncio 0.23 runs function-scoped async fixtures on a per-test
+    loop, so this is a sync fixture driving setup and teardown on the
+    session loop that test_engine (and every async test) runs on.
+    """
+    loop = asyncio.get_event_loop()
+    connection = loop.run_until_complete(test_engine.connect())
+    transaction = loop.run_until_complete(connection.begin())
+    session = AsyncSession(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        loop.run_until_complete(session.close())
+        loop.run_until_complete(transaction.rollback())
+        loop.run_until_complete(connection.close())
+
+
+def asgi_client() -> httpx.AsyncClient:
+    """AsyncClient that calls the app in-process on the running event loop."""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def _get(path: str) -> httpx.Response:
+    async with asgi_client() as ac:
+        return await ac.get(path)
+
+
+def _get_now(path: str) -> httpx.Response:
+    """GET on a private loop; asyncio.run() would unset the session test loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_get(path))
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def client(db_session):
+    """
+    AsyncClient whose get_db yields the test's rolled-back session.
+    
+    A sync fixture so it can serve tests on the session event loop; the
+    ASGI transport holds no connections, so the client needs no aclose().
+    """
+    async def override_get_db():
+        yield db_session
+
+    saved = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = override_get_db
+    yield asgi_client()
+    app.dependency_overrides.clear()
+    app.dependency_overrides.update(saved)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _redis_mock():
+    """Session-wide stand-in for the shared Redis client, reported as available."""
+    mock = AsyncMock()
+    mock.pipeline = MagicMock()
+    with patch('app.redis_conn.redis_client', mock), \
+            patch('app.redis_conn.redis_available', True):
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_redis(_redis_mock):
+    """Mock Redis for rate limiting tests, reset to a cache miss per test."""
+    _redis_mock.reset_mock(return_value=True, side_effect=True)
+    _redis_mock.get.return_value = None
+    return _redis_mock
+
 
 @pytest.fixture(scope="session")
-def test_engine():
-    """Create a test database engine."""
-    from app.database import Base
-    engine = create_engine(
-        "sqlite://",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
+def fake_redis_server():
+    """In-process fake Redis server, so private to each xdist worker."""
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def fake_redis(fake_redis_server, monkeypatch):
+    """Empty in-memory Redis that runs the real Lua scripts, for this test's loop."""
+    fakeredis.FakeRedis(server=fake_redis_server).flushall()
+    client = fakeredis.FakeAsyncRedis(server=fake_redis_server)
+    monkeypatch.setattr('app.redis_conn.redis_client', client)
+    return client
+
+
+@pytest.fixture
+def redis_allow(fake_redis):
+    """No prior requests, so the next one is the first of the day/month."""
+    return fake_redis
+
+
+@pytest.fixture
+def redis_block(fake_redis, fake_redis_server):
+    """The free-tier user's 24h window is already full."""
+    now_ms = int(time.time() * 1000)
+    limit = TIERS["free"]["requests_limit"]
+    fakeredis.FakeRedis(server=fake_redis_server).zadd(
+        "rate_limit:user_free", {f"seed{i}": now_ms for i in range(limit)}
     )
-    Base.metadata.create_all(bind=engine)
-    yield engine
-    Base.metadata.drop_all(bind=engine)
+    return fake_redis
+
+
+@pytest.fixture(scope="session")
+def free_auth_header():
+    return {"Authorization": "Bearer kzb_free_test123"}
+
+
+@pytest.fixture(scope="session")
+def hobby_auth_header():
+    return {"Authorization": "Bearer kzb_hobby_test456"}
+
+
+@pytest.fixture(scope="session")
+def pro_auth_header():
+    return {"Authorization": "Bearer kzb_pro_test789"}
+
+
+@pytest.fixture(scope="session")
+def bearer_creds():
+    """Parsed credentials for the free-tier test key."""
+    return HTTPAuthorizationCredentials(credentials="kzb_free_test123", scheme="Bearer")
+
+
+@pytest.fixture(scope="module")
+def root_response():
+    return _get_now("/")
+
+
+@pytest.fixture(scope="module")
+def health_response():
+    return _get_now("/health")
+
+
+@pytest.fixture(scope="module")
+def formats_response():
+    return _get_now("/formats")
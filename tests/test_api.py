@@ -1,69 +1,153 @@
 """Comprehensive test suite for Kazuba SaaS API — Production-Ready."""
 
-import pytest
+import asyncio
+import hashlib
+import hmac
 import io
+import os
+import sys
+import time
+from types import MappingProxyType
 from unittest.mock import Mock, patch, MagicMock, AsyncMock
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
-
-from app.main import app
-from app.database import Base, get_db
-from app.config import settings
-
-
-# Setup test database (SQLite in-memory)
-SQLALCHEMY_DATABASE_URL = "sqlite://"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
+import orjson
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from redis.exceptions import NoScriptError
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import IntegrityError
+
+from app import auth, convert, database, stripe_routes
+from app.main import app, convert as convert_handler, get_usage, health_check, HEALTH_JSON, LANDING_FILE, _HASHED_ASSET_RE
+from app.auth import get_current_user, hash_api_key
+from app.config import Settings, TIERS, get_settings, settings
+from app.convert import (
+    convert_document,
+    extract_text_from_docx,
+    extract_text_from_pdf,
+    extract_text_from_txt,
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
-        yield db
-    finally:
-        db.close()
-
-
-app.dependency_overrides[get_db] = override_get_db
-
-
-@pytest.fixture(scope="function")
-def client():
-    Base.metadata.create_all(bind=engine)
-    with TestClient(app) as c:
-        yield c
-    Base.metadata.drop_all(bind=engine)
+from app.database import get_db
+from app.rate_limit import rate_limit, read_usage, RATE_LIMIT_WINDOW
+from app.usage_flusher import USAGE_DIRTY_KEY, flush_usage_buffer, record_usage
+from models import ApiKey, TIER_CODES, UsageLog, User, UserTier
+
+# Optional extraction backends, as in app.convert
+try:
+    from docx import Document
+    from docx.enum.text import WD_BREAK
+    from docx.oxml import parse_xml
+except ImportError:
+    Document = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+requires_docx = pytest.mark.skipif(Document is None, reason="python-docx not installed")
+requires_pdfium = pytest.mark.skipif(pdfium is None, reason="pypdfium2 not installed")
+
+# Upload payloads shared by the endpoint tests: (filename, body, content type)
+TXT_FILE = ("test.txt", b"Hello World", "text/plain")
+MD_FILE = ("readme.md", b"# Title\nContent", "text/markdown")
+
+# Read-only user payloads; copy with dict() where rate_limit annotates them.
+# "user_free" is the id whose window redis_block fills.
+FREE_USER = MappingProxyType({"id": "user_free", "tier": "free", "requests_limit": 50})
+HOBBY_USER = MappingProxyType({
+    "tier": "hobby", "requests_today": 10, "requests_limit": 500,
+    "docs_this_month": 100, "docs_limit": 5000, "requests_remaining": 490,
+})
+EMPTY_USER = MappingProxyType({})
+# Integer id, as for a users row; only these reach the usage buffer
+DB_USER = MappingProxyType({"id": 7, "api_key_id": 3, "tier": "free", "requests_limit": 50})
+DB_USER_BUFFER_KEY = b"usage_buffer:7:3"
+
+# A run holding a text box, as Word writes it: DrawingML in mc:Choice and a
+# VML copy in mc:Fallback, each with its own w:txbxContent
+TEXT_BOX_RUN_XML = """
+<w:r xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+     xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"
+     xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"
+     xmlns:v="urn:schemas-microsoft-com:vml">
+  <mc:AlternateContent>
+    <mc:Choice Requires="wps">
+      <w:drawing><wps:wsp><wps:txbx><w:txbxContent>
+        <w:p><w:r><w:t>BoxText</w:t></w:r></w:p>
+      </w:txbxContent></wps:txbx></wps:wsp></w:drawing>
+    </mc:Choice>
+    <mc:Fallback>
+      <w:pict><v:shape><v:textbox><w:txbxContent>
+        <w:p><w:r><w:t>BoxText</w:t></w:r></w:p>
+      </w:txbxContent></v:textbox></v:shape></w:pict>
+    </mc:Fallback>
+  </mc:AlternateContent>
+</w:r>
+"""
+
+
+def crash_worker(file_bytes):
+    """Extractor that kills its process-pool worker, like a parser segfault."""
+    os._exit(1)
+
+
+class DictRedis:
+    """Just the GET/SETEX surface of the auth cache, backed by a dict."""
+
+    def __init__(self):
+        self.store = {}
+
+    async def get(self, key):
+        return self.store.get(key)
+
+    async def setex(self, key, ttl, value):
+        self.store[key] = value
+
+
+def make_text_pdf(*lines):
+    """Build a one-page PDF that draws each line in Helvetica."""
+    stream = b"BT /F1 12 Tf 72 720 Td 14 TL " + b" ".join(
+        b"(%s) '" % line.encode() for line in lines
+    ) + b" ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R"
+        b" /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref
+    )
+    return pdf
+
+
+# Route and middleware tables are fixed once app.main is imported
+ROUTES = {route.path for route in app.routes}
+MIDDLEWARE_NAMES = {m.cls.__name__ for m in app.user_middleware}
 
 
 @pytest.fixture
-def mock_redis():
-    """Mock Redis for rate limiting tests."""
-    with patch('app.rate_limit.redis_client') as mock:
-        with patch('app.rate_limit.redis_available', True):
-            yield mock
-
-
-@pytest.fixture
-def free_auth_header():
-    return {"Authorization": "Bearer kzb_free_test123"}
-
-
-@pytest.fixture
-def hobby_auth_header():
-    return {"Authorization": "Bearer kzb_hobby_test456"}
-
-
-@pytest.fixture
-def pro_auth_header():
-    return {"Authorization": "Bearer kzb_pro_test789"}
+def make_file():
+    """Build an UploadFile stand-in whose read() yields the given chunks, then EOF."""
+    def _make(filename, content_type, *chunks):
+        mock_file = AsyncMock()
+        mock_file.filename = filename
+        mock_file.content_type = content_type
+        mock_file.read.side_effect = [*chunks, b""]
+        return mock_file
+    return _make
 
 
 # =============================================================================
@@ -71,19 +155,33 @@ def pro_auth_header():
 # =============================================================================
 
 class TestRootEndpoint:
-    def test_root_returns_200(self, client):
-        response = client.get("/")
-        assert response.status_code == 200
+    def test_root_returns_200(self, root_response):
+        assert root_response.status_code == 200
 
-    def test_root_pricing_all_tiers(self, client):
-        response = client.get("/")
-        # It may return landing page HTML or JSON
-        if response.headers.get("content-type", "").startswith("application/json"):
-            data = response.json()
-            assert "pricing" in data
-            assert "free" in data["pricing"]
-            assert "hobby" in data["pricing"]
-            assert "pro" in data["pricing"]
+    async def test_root_pricing_all_tiers(self, client):
+        with patch("app.main.LANDING_FILE", None):
+            response = await client.get("/")
+        assert response.status_code == 200
+        assert {"free", "hobby", "pro"} <= response.json()["pricing"].keys()
+
+    def test_root_landing_sets_cache_control(self, root_response):
+        if LANDING_FILE is None:
+            pytest.skip("landing page not present")
+        assert root_response.headers["cache-control"] == "public, max-age=3600"
+
+    async def test_static_files_set_cache_control(self, client):
+        if LANDING_FILE is None:
+            pytest.skip("landing page not present")
+        response = await client.get("/static/index.html")
+        assert response.headers["cache-control"] == "public, max-age=3600"
+        assert _HASHED_ASSET_RE.search("landing/app.3f9a1c2b.js")
+        assert not _HASHED_ASSET_RE.search("landing/index.html")
+
+    async def test_root_without_landing_returns_api_info(self, client):
+        with patch("app.main.LANDING_FILE", None):
+            response = await client.get("/")
+        assert response.status_code == 200
+        assert response.json()["name"] == "Kazuba Converter SaaS API"
 
 
 # =============================================================================
@@ -91,44 +189,42 @@ class TestRootEndpoint:
 # =============================================================================
 
 class TestHealthEndpoint:
-    def test_health_returns_healthy(self, client):
-        response = client.get("/health")
-        assert response.status_code == 200
-        data = response.json()
-        assert data["status"] == "healthy"
+    def test_health_returns_healthy(self, health_response):
+        assert health_response.status_code == 200
+        assert health_response.json()["status"] == "healthy"
 
-    def test_health_includes_version(self, client):
-        response = client.get("/health")
-        data = response.json()
+    def test_health_includes_version(self, health_response):
+        data = health_response.json()
         assert "version" in data
         assert data["version"] == "0.1.0"
 
+    async def test_health_serves_precomputed_body(self):
+        with patch("app.main.ping_database", new_callable=AsyncMock, return_value=False):
+            response = await health_check()
+        assert response.body == HEALTH_JSON[False]
+        assert orjson.loads(response.body)["database"] == "disconnected"
+
 
 # =============================================================================
 # FORMATS ENDPOINT (new)
 # =============================================================================
 
 class TestFormatsEndpoint:
-    def test_formats_returns_200(self, client):
-        response = client.get("/formats")
-        assert response.status_code == 200
-        data = response.json()
+    def test_formats_returns_200(self, formats_response):
+        assert formats_response.status_code == 200
+        data = formats_response.json()
         assert "input_formats" in data
         assert "output_formats" in data
 
-    def test_formats_input_types(self, client):
-        response = client.get("/formats")
-        data = response.json()
-        extensions = [f["extension"] for f in data["input_formats"]]
+    def test_formats_input_types(self, formats_response):
+        extensions = [f["extension"] for f in formats_response.json()["input_formats"]]
         assert ".pdf" in extensions
         assert ".docx" in extensions
         assert ".txt" in extensions
         assert ".md" in extensions
 
-    def test_formats_output_types(self, client):
-        response = client.get("/formats")
-        data = response.json()
-        formats = [f["format"] for f in data["output_formats"]]
+    def test_formats_output_types(self, formats_response):
+        formats = [f["format"] for f in formats_response.json()["output_formats"]]
         assert "markdown" in formats
         assert "text" in formats
 
@@ -138,78 +234,153 @@ class TestFormatsEndpoint:
 # =============================================================================
 
 class TestAuthModule:
-    def test_free_key_returns_free_user(self):
-        from app.auth import get_current_user
-        from fastapi.security import HTTPAuthorizationCredentials
-
-        creds = HTTPAuthorizationCredentials(credentials="kzb_free_test", scheme="Bearer")
-        user = get_current_user(credentials=creds, db=Mock())
-        assert user["tier"] == "free"
-        assert user["requests_limit"] == 50
-
-    def test_hobby_key_returns_hobby_user(self):
-        from app.auth import get_current_user
-        from fastapi.security import HTTPAuthorizationCredentials
-
-        creds = HTTPAuthorizationCredentials(credentials="kzb_hobby_test", scheme="Bearer")
-        user = get_current_user(credentials=creds, db=Mock())
-        assert user["tier"] == "hobby"
-        assert user["requests_limit"] == 500
-
-    def test_pro_key_returns_pro_user(self):
-        from app.auth import get_current_user
-        from fastapi.security import HTTPAuthorizationCredentials
-
-        creds = HTTPAuthorizationCredentials(credentials="kzb_pro_test", scheme="Bearer")
-        user = get_current_user(credentials=creds, db=Mock())
-        assert user["tier"] == "pro"
-        assert user["requests_limit"] == 5000
-
-    def test_invalid_key_raises_401(self):
-        from app.auth import get_current_user
-        from fastapi.security import HTTPAuthorizationCredentials
-        from fastapi import HTTPException
-
+    @pytest.mark.parametrize("key,tier,limit", [
+        ("kzb_free_test", "free", 50),
+        ("kzb_hobby_test", "hobby", 500),
+        ("kzb_pro_test", "pro", 5000),
+    ])
+    async def test_key_prefix_selects_tier(self, key, tier, limit):
+        creds = HTTPAuthorizationCredentials(credentials=key, scheme="Bearer")
+        user = await get_current_user(credentials=creds, db=None)
+        assert user["tier"] == tier
+        assert user["requests_limit"] == limit
+
+    async def test_invalid_key_raises_401(self):
         creds = HTTPAuthorizationCredentials(credentials="invalid", scheme="Bearer")
         with pytest.raises(HTTPException) as exc_info:
-            get_current_user(credentials=creds, db=Mock())
+            await get_current_user(credentials=creds, db=None)
         assert exc_info.value.status_code == 401
 
+    async def test_cached_user_is_copied(self, bearer_creds):
+        first = await get_current_user(credentials=bearer_creds, db=None)
+        first["requests_remaining"] = 0
+        second = await get_current_user(credentials=bearer_creds, db=None)
+        assert second["tier"] == "free"
+        assert "requests_remaining" not in second
+
+    async def test_invalid_key_is_negative_cached(self):
+        auth.clear_validation_cache()
+        creds = HTTPAuthorizationCredentials(credentials="bogus_key", scheme="Bearer")
+        with patch.object(auth, "_lookup_user", return_value=None) as lookup:
+            for _ in range(2):
+                with pytest.raises(HTTPException):
+                    await auth.get_current_user(credentials=creds, db=None)
+        assert lookup.call_count == 1
+
+    def test_hash_api_key_is_signed_64bit(self):
+        value = hash_api_key("kzb_pro_test789")
+        assert value == hash_api_key("kzb_pro_test789")
+        assert value != hash_api_key("kzb_pro_test780")
+        assert -(2 ** 63) <= value < 2 ** 63
+
+    async def test_redis_cache_shared_across_workers(self, bearer_creds):
+        auth.clear_validation_cache()
+
+        with patch("app.redis_conn.redis_client", DictRedis()):
+            await auth.get_current_user(credentials=bearer_creds, db=None)
+            auth.clear_validation_cache()  # simulate another worker
+            with patch.object(auth, "_lookup_user") as lookup:
+                user = await auth.get_current_user(credentials=bearer_creds, db=None)
+        lookup.assert_not_called()
+        assert user["tier"] == "free"
+
 
 # =============================================================================
 # RATE LIMIT MODULE
 # =============================================================================
 
 class TestRateLimitModule:
-    def test_rate_limit_none_user(self):
-        from app.rate_limit import rate_limit
-        result = rate_limit(None)
+    async def test_rate_limit_none_user(self):
+        result = await rate_limit(None)
         assert result is None
 
-    def test_rate_limit_first_request(self, mock_redis):
-        from app.rate_limit import rate_limit
-
-        mock_redis.get.return_value = None
-        pipe = Mock()
-        pipe.incr.return_value = None
-        pipe.expire.return_value = None
-        pipe.execute.return_value = [1, True]
-        mock_redis.pipeline.return_value = pipe
-
-        user = {"id": "u1", "tier": "free", "requests_limit": 50}
-        rate_limit(user)
+    async def test_rate_limit_first_request(self, redis_allow):
+        user = dict(FREE_USER)
+        await rate_limit(user)
         assert user["requests_today"] == 1
         assert user["requests_remaining"] == 49
+        assert "docs_this_month" not in user
 
-    def test_rate_limit_exceeded(self, mock_redis):
-        from app.rate_limit import rate_limit
-        from fastapi import HTTPException
+    async def test_rate_limit_exceeded(self, redis_block):
+        user = dict(FREE_USER)
+        try:
+            await rate_limit(user)
+        except HTTPException as e:
+            assert e.status_code == 429
+        else:
+            pytest.fail("expected HTTPException")
+
+    async def test_rate_limit_retry_after_from_oldest_request(self, mock_redis):
+        now_ms = 1_700_000_000_000
+        # Oldest request in the window was made one hour ago
+        mock_redis.evalsha.return_value = [-1, now_ms - 3_600_000]
+        user = dict(FREE_USER)
+        with patch("app.rate_limit.time.time", return_value=now_ms / 1000):
+            with pytest.raises(HTTPException) as exc_info:
+                await rate_limit(user)
+        assert exc_info.value.headers["Retry-After"] == str(RATE_LIMIT_WINDOW - 3600)
+
+    async def test_rate_limit_reloads_script_on_noscript(self, mock_redis):
+        mock_redis.evalsha.side_effect = NoScriptError("NOSCRIPT")
+        mock_redis.eval.return_value = [3, 0]
+        user = dict(FREE_USER)
+        await rate_limit(user)
+        assert user["requests_today"] == 3
+        assert user["requests_remaining"] == 47
+
+    async def test_rate_limit_redis_error_allows_request(self, mock_redis):
+        mock_redis.evalsha.side_effect = ConnectionError("down")
+        user = dict(FREE_USER)
+        await rate_limit(user)
+        assert user["requests_remaining"] == 50
 
-        mock_redis.get.return_value = "50"
-        user = {"id": "u1", "tier": "free", "requests_limit": 50}
-        with pytest.raises(HTTPException) as exc_info:
-            rate_limit(user)
-        assert exc_info.value.status_code == 429
+
+# =============================================================================
+# USAGE FLUSHER
+# =============================================================================
+
+class TestUsageFlusher:
+    @staticmethod
+    def _session():
+        session = MagicMock()
+        session.__aenter__ = AsyncMock(return_value=session)
+        session.__aexit__ = AsyncMock(return_value=False)
+        session.execute = AsyncMock()
+        session.commit = AsyncMock()
+        return session
+
+    async def test_record_usage_buffers_only_db_users(self, redis_allow):
+        db_user, free_user = dict(DB_USER), dict(FREE_USER)
+        for user in (db_user, db_user, free_user):
+            await record_usage(user, "/convert")
+        assert await redis_allow.smembers(USAGE_DIRTY_KEY) == {DB_USER_BUFFER_KEY}
+        assert await redis_allow.hgetall(DB_USER_BUFFER_KEY) == {b"/convert": b"2"}
+        # The monthly count covers every user
+        assert db_user["docs_this_month"] == 2
+        assert free_user["docs_this_month"] == 1
+
+    async def test_flush_batches_rows_and_skips_prefix_users(self, redis_allow):
+        for _ in range(2):
+            await record_usage(dict(DB_USER), "/convert")
+        await redis_allow.hincrby(b"usage_buffer:user_free:0", "/convert", 5)
+        await redis_allow.sadd(USAGE_DIRTY_KEY, b"usage_buffer:user_free:0")
+        session = self._session()
+        with patch("app.usage_flusher.SessionLocal", return_value=session):
+            assert await flush_usage_buffer() == 2
+        rows = session.execute.call_args.args[1]
+        assert rows == [{"user_id": 7, "api_key_id": 3, "endpoint": "/convert", "status_code": 200}] * 2
+        session.commit.assert_awaited_once()
+        assert await redis_allow.exists(USAGE_DIRTY_KEY, DB_USER_BUFFER_KEY) == 0
+
+    async def test_flush_rebuffers_on_insert_failure(self, redis_allow):
+        for _ in range(4):
+            await record_usage(dict(DB_USER), "/convert")
+        session = self._session()
+        session.execute.side_effect = Exception("db down")
+        with patch("app.usage_flusher.SessionLocal", return_value=session):
+            assert await flush_usage_buffer() == 0
+        assert await redis_allow.smembers(USAGE_DIRTY_KEY) == {DB_USER_BUFFER_KEY}
+        assert await redis_allow.hgetall(DB_USER_BUFFER_KEY) == {b"/convert": b"4"}
 
 
 # =============================================================================
@@ -217,14 +388,8 @@ class TestRateLimitModule:
 # =============================================================================
 
 class TestConvertModule:
-    @pytest.mark.asyncio
-    async def test_convert_txt_file(self):
-        from app.convert import convert_document
-
-        mock_file = AsyncMock()
-        mock_file.filename = "test.txt"
-        mock_file.content_type = "text/plain"
-        mock_file.read.return_value = b"Hello, World!"
+    async def test_convert_txt_file(self, make_file):
+        mock_file = make_file("test.txt", "text/plain", b"Hello, World!")
 
         result = await convert_document(mock_file)
         assert result["status"] == "converted"
@@ -232,138 +397,223 @@ class TestConvertModule:
         assert result["file_type"] == "txt"
         assert "Hello, World!" in result["content"]
 
-    @pytest.mark.asyncio
-    async def test_convert_md_file(self):
-        from app.convert import convert_document
-
-        mock_file = AsyncMock()
-        mock_file.filename = "test.md"
-        mock_file.content_type = "text/markdown"
-        mock_file.read.return_value = b"# Title\n\nParagraph"
+    async def test_convert_md_file(self, make_file):
+        mock_file = make_file("test.md", "text/markdown", b"# Title\n\nParagraph")
 
         result = await convert_document(mock_file)
         assert result["status"] == "converted"
         assert result["file_type"] == "md"
         assert "# Title" in result["content"]
 
-    @pytest.mark.asyncio
-    async def test_convert_unsupported_type_raises_400(self):
-        from app.convert import convert_document
-        from fastapi import HTTPException
-
-        mock_file = AsyncMock()
-        mock_file.filename = "test.exe"
-        mock_file.content_type = "application/x-msdownload"
-        mock_file.read.return_value = b"binary"
+    async def test_convert_unsupported_type_raises_400(self, make_file):
+        mock_file = make_file("test.exe", "application/x-msdownload", b"binary")
 
         with pytest.raises(HTTPException) as exc_info:
             await convert_document(mock_file)
         assert exc_info.value.status_code == 400
 
-    @pytest.mark.asyncio
-    async def test_convert_empty_file_raises_400(self):
-        from app.convert import convert_document
-        from fastapi import HTTPException
-
-        mock_file = AsyncMock()
-        mock_file.filename = "empty.txt"
-        mock_file.content_type = "text/plain"
-        mock_file.read.return_value = b""
+    async def test_convert_empty_file_raises_400(self, make_file):
+        mock_file = make_file("empty.txt", "text/plain")
 
         with pytest.raises(HTTPException) as exc_info:
             await convert_document(mock_file)
         assert exc_info.value.status_code == 400
 
-    @pytest.mark.asyncio
-    async def test_convert_text_output_format(self):
-        from app.convert import convert_document
+    async def test_convert_oversized_file_raises_413(self, make_file):
+        mock_file = make_file("big.txt", "text/plain", b"x" * 8, b"x" * 8)
 
-        mock_file = AsyncMock()
-        mock_file.filename = "test.txt"
-        mock_file.content_type = "text/plain"
-        mock_file.read.return_value = b"Raw text content"
+        with patch.dict(convert.MAX_BYTES_BY_TIER, {"free": 10}):
+            with pytest.raises(HTTPException) as exc_info:
+                await convert.convert_document(mock_file, user_tier="free")
+        assert exc_info.value.status_code == 413
+
+    async def test_convert_text_output_format(self, make_file):
+        mock_file = make_file("test.txt", "text/plain", b"Raw text content")
 
         result = await convert_document(mock_file, output_format="text")
         assert result["output_format"] == "text"
         assert result["content"] == "Raw text content"
 
-    @pytest.mark.asyncio
-    async def test_convert_invalid_output_format(self):
-        from app.convert import convert_document
-        from fastapi import HTTPException
-
-        mock_file = AsyncMock()
-        mock_file.filename = "test.txt"
-        mock_file.content_type = "text/plain"
-        mock_file.read.return_value = b"content"
+    async def test_convert_invalid_output_format(self, make_file):
+        mock_file = make_file("test.txt", "text/plain", b"content")
 
         with pytest.raises(HTTPException) as exc_info:
             await convert_document(mock_file, output_format="html")
         assert exc_info.value.status_code == 400
 
+    def test_extract_text_from_txt_replaces_invalid_utf8(self):
+        text = extract_text_from_txt("ação ".encode("utf-8") + b"\xff")
+        assert text == "ação \ufffd"
+
+    @requires_docx
+    def test_extract_text_from_docx_skips_blank_paragraphs(self):
+        doc = Document()
+        doc.add_paragraph("First")
+        doc.add_paragraph("   ")
+        doc.add_paragraph("Second")
+        buf = io.BytesIO()
+        doc.save(buf)
+
+        assert extract_text_from_docx(buf.getvalue()) == "First\n\nSecond"
+
+    @requires_docx
+    def test_extract_text_from_docx_joins_runs_and_tables(self):
+        doc = Document()
+        para = doc.add_paragraph("Hello, ")
+        para.add_run("World")
+        doc.add_table(rows=1, cols=1).cell(0, 0).text = "Cell"
+        buf = io.BytesIO()
+        doc.save(buf)
+
+        assert extract_text_from_docx(buf.getvalue()) == "Hello, World\n\nCell"
+
+    @requires_docx
+    def test_extract_text_from_docx_keeps_tabs_and_line_breaks(self):
+        doc = Document()
+        para = doc.add_paragraph("Name\tValue")
+        para.paragraph_format.tab_stops.add_tab_stop(914400)
+        para.add_run("line1").add_break()
+        para.add_run("line2").add_break(WD_BREAK.PAGE)
+        buf = io.BytesIO()
+        doc.save(buf)
+
+        assert extract_text_from_docx(buf.getvalue()) == para.text == "Name\tValueline1\nline2"
+
+    @requires_docx
+    def test_extract_text_from_docx_skips_text_boxes(self):
+        doc = Document()
+        doc.add_paragraph("Outer ")._p.append(parse_xml(TEXT_BOX_RUN_XML))
+        cell = doc.add_table(rows=1, cols=1).cell(0, 0)
+        cell.text = "Cell"
+        cell.paragraphs[0]._p.append(parse_xml(TEXT_BOX_RUN_XML))
+        buf = io.BytesIO()
+        doc.save(buf)
+
+        assert extract_text_from_docx(buf.getvalue()) == "Outer \n\nCell"
+
+    @requires_pdfium
+    def test_extract_text_from_pdf_blank_page(self):
+        pdf = pdfium.PdfDocument.new()
+        pdf.new_page(200, 200)
+        buf = io.BytesIO()
+        pdf.save(buf)
+        pdf.close()
+
+        assert extract_text_from_pdf(buf.getvalue()) == ""
+
+    @pytest.mark.parametrize("backend", [
+        pytest.param("_extract_pdf_pdfium", marks=requires_pdfium),
+        "_extract_pdf_pypdf",
+    ])
+    def test_extract_text_from_pdf_uses_lf_line_breaks(self, backend):
+        pdf = make_text_pdf("Hello line one", "Second line")
+        assert getattr(convert, backend)(pdf) == "Hello line one\nSecond line"
+
+    def test_extract_text_from_pdf_without_backends_raises_503(self):
+        with patch.object(convert, "PDFIUM_AVAILABLE", False), \
+                patch.object(convert, "PYPDF_AVAILABLE", False):
+            with pytest.raises(HTTPException) as exc_info:
+                convert.extract_text_from_pdf(b"%PDF-1.4")
+        assert exc_info.value.status_code == 503
+
+    @requires_docx
+    async def test_offloaded_extraction_runs_in_pool(self):
+        doc = Document()
+        doc.add_paragraph("Pooled")
+        buf = io.BytesIO()
+        doc.save(buf)
+
+        with patch.object(convert, "PROCESS_POOL_MIN_BYTES", 0):
+            text = await convert._extract_offloaded(
+                convert.extract_text_from_docx, buf.getvalue()
+            )
+        assert text == "Pooled"
+
+    async def test_offloaded_extraction_recovers_from_dead_worker(self):
+        with patch.object(convert, "PROCESS_POOL_MIN_BYTES", 0):
+            with pytest.raises(HTTPException) as exc_info:
+                await convert._extract_offloaded(crash_worker, b"boom")
+            assert exc_info.value.status_code == 422
+            text = await convert._extract_offloaded(convert.extract_text_from_txt, b"Recovered")
+        assert text == "Recovered"
+
+    async def test_offloaded_extraction_propagates_http_errors(self):
+        with patch.object(convert, "PROCESS_POOL_MIN_BYTES", 0):
+            with pytest.raises(HTTPException) as exc_info:
+                await convert._extract_offloaded(
+                    convert.extract_text_from_pdf, b"not a pdf"
+                )
+        assert exc_info.value.status_code == 400
+
 
 # =============================================================================
 # CONVERT ENDPOINT (integration)
 # =============================================================================
 
 class TestConvertEndpoint:
-    def test_convert_no_auth_returns_403(self, client):
-        response = client.post("/convert")
+    async def test_convert_no_auth_returns_403(self, client):
+        response = await client.post("/convert")
         assert response.status_code == 403
 
-    def test_convert_invalid_key_returns_401(self, client):
-        response = client.post(
+    async def test_convert_invalid_key_returns_401(self, client):
+        response = await client.post(
             "/convert",
             headers={"Authorization": "Bearer invalid_key"},
-            files={"file": ("test.txt", b"hello", "text/plain")}
+            files={"file": TXT_FILE}
         )
         assert response.status_code == 401
 
-    def test_convert_txt_file_success(self, client, mock_redis, free_auth_header):
-        mock_redis.get.return_value = None
-        pipe = Mock()
-        pipe.incr.return_value = None
-        pipe.expire.return_value = None
-        pipe.execute.return_value = [1, True]
-        mock_redis.pipeline.return_value = pipe
-
-        response = client.post(
-            "/convert",
-            headers=free_auth_header,
-            files={"file": ("test.txt", b"Hello World", "text/plain")}
-        )
-        assert response.status_code == 200
-        data = response.json()
-        assert data["status"] == "converted"
-        assert data["filename"] == "test.txt"
-        assert data["user_tier"] == "free"
-        assert "Hello World" in data["content"]
-
-    def test_convert_md_file_success(self, client, mock_redis, hobby_auth_header):
-        mock_redis.get.return_value = None
-        pipe = Mock()
-        pipe.incr.return_value = None
-        pipe.expire.return_value = None
-        pipe.execute.return_value = [1, True]
-        mock_redis.pipeline.return_value = pipe
-
-        response = client.post(
+    @pytest.mark.parametrize("payload,tier", [(TXT_FILE, "free"), (MD_FILE, "hobby")])
+    async def test_convert_file_success(self, client, redis_allow, request, payload, tier):
+        response = await client.post(
             "/convert",
-            headers=hobby_auth_header,
-            files={"file": ("readme.md", b"# Title\nContent", "text/markdown")}
+            headers=request.getfixturevalue(f"{tier}_auth_header"),
+            files={"file": payload}
         )
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "converted"
-        assert data["user_tier"] == "hobby"
-
-    def test_convert_rate_limited(self, client, mock_redis, free_auth_header):
-        mock_redis.get.return_value = "50"
-
-        response = client.post(
+        assert data["filename"] == payload[0]
+        assert data["user_tier"] == tier
+        assert payload[1].decode() in data["content"]
+
+    @pytest.mark.parametrize("redis_state,expect_status,expect_remaining", [
+        ("redis_allow", None, 49),
+        ("redis_block", 429, None),
+    ], ids=["under_limit", "over_limit"])
+    async def test_convert_handler_rate_limit(
+        self, request, make_file, redis_state, expect_status, expect_remaining
+    ):
+        request.getfixturevalue(redis_state)
+        filename, body, content_type = TXT_FILE
+        upload = make_file(filename, content_type, body)
+        user = dict(FREE_USER)
+        if expect_status is not None:
+            with pytest.raises(HTTPException) as exc_info:
+                await convert_handler(upload, "markdown", user)
+            assert exc_info.value.status_code == expect_status
+        else:
+            result = await convert_handler(upload, "markdown", user)
+            assert result["user_tier"] == "free"
+            assert result["requests_remaining"] == expect_remaining
+
+    async def test_convert_handler_counts_only_successes(self, redis_allow, make_file):
+        user = dict(DB_USER)
+        with pytest.raises(HTTPException):
+            await convert_handler(make_file("empty.txt", "text/plain"), "markdown", user)
+        filename, body, content_type = TXT_FILE
+        await convert_handler(make_file(filename, content_type, body), "markdown", user)
+        assert await redis_allow.hgetall(DB_USER_BUFFER_KEY) == {b"/convert": b"1"}
+        # Both requests used the daily window; only the success is a doc
+        usage = await read_usage(user)
+        assert usage["requests_today"] == 2
+        assert usage["docs_this_month"] == 1
+
+    async def test_convert_rate_limited(self, client, redis_block, free_auth_header):
+        response = await client.post(
             "/convert",
             headers=free_auth_header,
-            files={"file": ("test.txt", b"hello", "text/plain")}
+            files={"file": TXT_FILE}
         )
         assert response.status_code == 429
 
@@ -373,24 +623,39 @@ class TestConvertEndpoint:
 # =============================================================================
 
 class TestUsageEndpoint:
-    def test_usage_no_auth_returns_403(self, client):
-        response = client.get("/usage")
+    async def test_usage_no_auth_returns_403(self, client):
+        response = await client.get("/usage")
         assert response.status_code == 403
 
-    def test_usage_with_free_key(self, client, free_auth_header):
-        response = client.get("/usage", headers=free_auth_header)
+    @pytest.mark.parametrize("tier,requests_limit,docs_limit", [
+        ("free", 50, 100),
+        ("pro", 5000, 50000),
+    ])
+    async def test_usage_with_key(self, client, redis_allow, request, tier, requests_limit, docs_limit):
+        response = await client.get("/usage", headers=request.getfixturevalue(f"{tier}_auth_header"))
         assert response.status_code == 200
         data = response.json()
-        assert data["tier"] == "free"
-        assert data["requests_limit"] == 50
-        assert data["docs_limit"] == 100
+        assert data["tier"] == tier
+        assert data["requests_limit"] == requests_limit
+        assert data["docs_limit"] == docs_limit
 
-    def test_usage_with_pro_key(self, client, pro_auth_header):
-        response = client.get("/usage", headers=pro_auth_header)
-        assert response.status_code == 200
-        data = response.json()
-        assert data["tier"] == "pro"
-        assert data["requests_limit"] == 5000
+    async def test_usage_counts_convert_requests(self, client, redis_allow, free_auth_header):
+        for _ in range(2):
+            await client.post("/convert", headers=free_auth_header, files={"file": TXT_FILE})
+        data = (await client.get("/usage", headers=free_auth_header)).json()
+        assert data["requests_today"] == 2
+        assert data["requests_remaining"] == 48
+        assert data["docs_this_month"] == 2
+
+    async def test_get_usage_defaults(self, redis_allow):
+        assert await get_usage(EMPTY_USER) == {
+            "tier": "free", "requests_today": 0, "requests_limit": 50,
+            "docs_this_month": 0, "docs_limit": 100, "requests_remaining": 50,
+        }
+
+    async def test_get_usage_without_redis_uses_user_fields(self):
+        with patch("app.redis_conn.redis_available", False):
+            assert await get_usage(HOBBY_USER) == dict(HOBBY_USER)
 
 
 # =============================================================================
@@ -398,18 +663,67 @@ class TestUsageEndpoint:
 # =============================================================================
 
 class TestStripeRoutes:
-    def test_stripe_config_returns_200(self, client):
-        response = client.get("/stripe/config")
+    async def test_stripe_config_returns_200(self):
+        response = await stripe_routes.get_stripe_config()
         assert response.status_code == 200
-        data = response.json()
-        assert "prices" in data
+        assert "prices" in orjson.loads(response.body)
 
-    def test_checkout_without_stripe_returns_503(self, client):
-        response = client.post("/stripe/create-checkout-session?tier=hobby")
+    async def test_checkout_without_stripe_returns_503(self, client):
+        response = await client.post("/stripe/create-checkout-session?tier=hobby")
         assert response.status_code == 503
 
-    def test_webhook_without_config_returns_ok(self, client):
-        response = client.post(
+    async def test_checkout_uses_precomputed_session_args(self, client):
+        session = Mock(url="https://checkout.stripe.test/s", id="cs_test")
+        with patch.object(stripe_routes.settings, "STRIPE_SECRET_KEY", "sk_test_real"), \
+                patch.dict(stripe_routes.PRICE_MAP, {"pro": "price_pro"}), \
+                patch.dict(stripe_routes.LINE_ITEMS, {"pro": [{"price": "price_pro", "quantity": 1}]}), \
+                patch("stripe.checkout.Session.create", return_value=session) as create:
+            response = await client.post("/stripe/create-checkout-session?tier=pro")
+        assert response.status_code == 200
+        assert response.json()["session_id"] == "cs_test"
+        kwargs = create.call_args.kwargs
+        assert kwargs["line_items"] == [{"price": "price_pro", "quantity": 1}]
+        assert kwargs["success_url"] == stripe_routes.SUCCESS_URL
+        assert kwargs["cancel_url"] == stripe_routes.CANCEL_URL
+
+    async def _signed_webhook(self, client, payload, secret, signature=None):
+        timestamp = str(int(time.time()))
+        if signature is None:
+            signature = hmac.new(
+                secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256
+            ).hexdigest()
+        proto = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+        with patch.object(stripe_routes.settings, "STRIPE_WEBHOOK_SECRET", secret), \
+                patch.object(stripe_routes, "WEBHOOK_HMAC", proto):
+            return await client.post(
+                "/stripe/webhook",
+                content=payload,
+                headers={"Stripe-Signature": f"t={timestamp},v1={signature}"},
+            )
+
+    async def test_webhook_valid_signature_accepted(self, client):
+        payload = b'{"type": "invoice.paid", "data": {"object": {"id": "in_1"}}}'
+        response = await self._signed_webhook(client, payload, "whsec_test")
+        assert response.status_code == 200
+        assert response.json()["status"] == "success"
+
+    async def test_webhook_dispatches_by_event_type(self, client):
+        handler = AsyncMock()
+        payload = b'{"type": "invoice.paid", "data": {"object": {"id": "in_1"}}}'
+        with patch.dict(stripe_routes.WEBHOOK_HANDLERS, {"invoice.paid": handler}):
+            assert (await self._signed_webhook(client, payload, "whsec_test")).status_code == 200
+            unknown = b'{"type": "charge.refunded", "data": {"object": {"id": "ch_1"}}}'
+            assert (await self._signed_webhook(client, unknown, "whsec_test")).status_code == 200
+        handler.assert_awaited_once_with({"id": "in_1"})
+
+    async def test_webhook_invalid_signature_rejected(self, client):
+        payload = b'{"type": "invoice.paid", "data": {"object": {"id": "in_1"}}}'
+        response = await self._signed_webhook(client, payload, "whsec_test", signature="00" * 32)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid signature"
+
+    async def test_webhook_without_config_returns_ok(self, client):
+        response = await client.post(
             "/stripe/webhook",
             content=b'{"type": "test"}',
             headers={"Content-Type": "application/json"}
@@ -425,30 +739,39 @@ class TestStripeRoutes:
 
 class TestModels:
     def test_user_tier_enum(self):
-        from models import UserTier
         assert UserTier.FREE == "free"
         assert UserTier.HOBBY == "hobby"
         assert UserTier.PRO == "pro"
         assert UserTier.ENTERPRISE == "enterprise"
 
     def test_user_model_columns(self):
-        from models import User
         assert User.__tablename__ == "users"
-        assert hasattr(User, 'email')
-        assert hasattr(User, 'tier')
-        assert hasattr(User, 'stripe_customer_id')
+        assert {"email", "tier", "stripe_customer_id"} <= set(User.__table__.columns.keys())
+
+    async def test_user_tier_stored_as_smallint(self, db_session):
+        db_session.add(User(email="tier@example.com", tier=UserTier.PRO))
+        await db_session.commit()
+        stored = (await db_session.execute(text("SELECT tier FROM users"))).scalar()
+        assert stored == TIER_CODES[UserTier.PRO]
+        assert (await db_session.execute(select(User))).scalar_one().tier is UserTier.PRO
+        db_session.add(User(email="str@example.com", tier="hobby"))
+        await db_session.commit()
+        hobby = await db_session.execute(select(User).filter_by(email="str@example.com"))
+        assert hobby.scalar_one().tier is UserTier.HOBBY
+
+    async def test_user_tier_check_constraint(self, db_session):
+        with pytest.raises(IntegrityError):
+            await db_session.execute(
+                text("INSERT INTO users (email, tier) VALUES ('x@example.com', 9)")
+            )
 
     def test_api_key_model_columns(self):
-        from models import ApiKey
         assert ApiKey.__tablename__ == "api_keys"
-        assert hasattr(ApiKey, 'key_hash')
-        assert hasattr(ApiKey, 'user_id')
+        assert {"key_hash", "user_id"} <= set(ApiKey.__table__.columns.keys())
 
     def test_usage_log_model_columns(self):
-        from models import UsageLog
         assert UsageLog.__tablename__ == "usage_logs"
-        assert hasattr(UsageLog, 'endpoint')
-        assert hasattr(UsageLog, 'status_code')
+        assert {"endpoint", "status_code"} <= set(UsageLog.__table__.columns.keys())
 
 
 # =============================================================================
@@ -456,15 +779,79 @@ class TestModels:
 # =============================================================================
 
 class TestDatabaseModule:
-    def test_get_db_yields_session(self):
-        from app.database import get_db
+    async def test_get_db_yields_session(self):
         gen = get_db()
-        db = next(gen)
+        db = await gen.__anext__()
         assert db is not None
-        try:
-            next(gen)
-        except StopIteration:
-            pass
+        await gen.aclose()
+
+    @pytest.mark.parametrize("url,expected", [
+        ("postgres://u:p@db/kz", "postgresql+asyncpg://u:p@db/kz"),
+        ("postgresql://u:p@db/kz", "postgresql+asyncpg://u:p@db/kz"),
+        ("postgresql+psycopg2://u:p@db/kz", "postgresql+asyncpg://u:p@db/kz"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+        ("postgresql+asyncpg://u:p@db/kz", "postgresql+asyncpg://u:p@db/kz"),
+    ])
+    def test_to_async_url(self, url, expected):
+        assert database.to_async_url(url) == expected
+
+    async def test_client_get_db_yields_rolled_back_async_session(self, client, db_session):
+        override = app.dependency_overrides[get_db]()
+        db = await override.__anext__()
+        assert db is db_session
+        db.add(User(email="override@example.com"))
+        await db.flush()
+        count = await db.execute(select(func.count()).select_from(User))
+        assert count.scalar() == 1
+        await override.aclose()
+
+    async def test_ping_database_caches_result(self):
+        with patch.object(database, "_last_ping", (0.0, False)), \
+                patch.object(database, "engine") as mock_engine:
+            mock_engine.connect.side_effect = Exception("down")
+            assert await database.ping_database() is False
+            assert await database.ping_database() is False
+        assert mock_engine.connect.call_count == 1
+
+    async def test_ping_database_times_out(self):
+        async def hang():
+            await asyncio.sleep(60)
+
+        with patch.object(database, "_last_ping", (0.0, True)), \
+                patch.object(database, "DB_PING_TIMEOUT", 0.01), \
+                patch.object(database, "_select_one", hang):
+            assert await database.ping_database() is False
+
+    async def test_ping_database_single_flight(self):
+        calls = 0
+
+        async def slow_select():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+
+        with patch.object(database, "_last_ping", (0.0, False)), \
+                patch.object(database, "_select_one", slow_select):
+            results = await asyncio.gather(*(database.ping_database() for _ in range(5)))
+        assert results == [True] * 5
+        assert calls == 1
+
+
+# =============================================================================
+# APP CONFIGURATION
+# =============================================================================
+
+class TestAppConfiguration:
+    def test_app_metadata(self):
+        assert app.title == "Kazuba Converter SaaS API"
+        assert app.version == "0.1.0"
+
+    def test_cors_middleware_configured(self):
+        assert "CORSMiddleware" in MIDDLEWARE_NAMES
+
+    def test_routes_registered(self):
+        assert {"/", "/health", "/convert", "/usage", "/formats",
+                "/stripe/webhook", "/stripe/config"} <= ROUTES
 
 
 # =============================================================================
@@ -472,19 +859,28 @@ class TestDatabaseModule:
 # =============================================================================
 
 class TestConfigModule:
-    def test_default_rate_limits(self):
-        from app.config import Settings
-        s = Settings()
-        assert s.RATE_LIMIT_FREE == 50
-        assert s.RATE_LIMIT_HOBBY == 500
-        assert s.RATE_LIMIT_PRO == 5000
+    @pytest.fixture(scope="class")
+    def default_settings(self):
+        return Settings()
+
+    def test_default_rate_limits(self, default_settings):
+        assert default_settings.RATE_LIMIT_FREE == 50
+        assert default_settings.RATE_LIMIT_HOBBY == 500
+        assert default_settings.RATE_LIMIT_PRO == 5000
 
-    def test_default_doc_limits(self):
-        from app.config import Settings
-        s = Settings()
-        assert s.DOC_LIMIT_FREE == 100
-        assert s.DOC_LIMIT_HOBBY == 5000
-        assert s.DOC_LIMIT_PRO == 50000
+    def test_tiers_mapping_is_frozen_and_interned(self):
+        assert TIERS["pro"]["requests_limit"] == 5000
+        assert all(sys.intern(tier) is tier for tier in TIERS)
+        with pytest.raises(TypeError):
+            TIERS["pro"]["requests_limit"] = 1
+
+    def test_default_doc_limits(self, default_settings):
+        assert default_settings.DOC_LIMIT_FREE == 100
+        assert default_settings.DOC_LIMIT_HOBBY == 5000
+        assert default_settings.DOC_LIMIT_PRO == 50000
+
+    def test_get_settings_is_singleton(self):
+        assert get_settings() is settings
 
 
 # =============================================================================
@@ -492,40 +888,23 @@ class TestConfigModule:
 # =============================================================================
 
 class TestIntegration:
-    def test_full_flow_free_tier(self, client, mock_redis, free_auth_header):
-        mock_redis.get.return_value = None
-        pipe = Mock()
-        pipe.incr.return_value = None
-        pipe.expire.return_value = None
-        pipe.execute.return_value = [1, True]
-        mock_redis.pipeline.return_value = pipe
-
+    async def test_full_flow_free_tier(self, client, redis_allow, free_auth_header):
         # 1. Health
-        assert client.get("/health").status_code == 200
+        assert (await client.get("/health")).status_code == 200
 
         # 2. Formats
-        assert client.get("/formats").status_code == 200
+        assert (await client.get("/formats")).status_code == 200
 
         # 3. Usage
-        usage = client.get("/usage", headers=free_auth_header)
+        usage = await client.get("/usage", headers=free_auth_header)
         assert usage.status_code == 200
         assert usage.json()["tier"] == "free"
 
         # 4. Convert
-        convert = client.post(
+        converted = await client.post(
             "/convert",
             headers=free_auth_header,
-            files={"file": ("doc.txt", b"Document content here", "text/plain")}
+            files={"file": TXT_FILE}
         )
-        assert convert.status_code == 200
-        assert convert.json()["status"] == "converted"
-
-    def test_rate_limit_enforcement(self, client, mock_redis, free_auth_header):
-        mock_redis.get.return_value = "50"
-
-        response = client.post(
-            "/convert",
-            headers=free_auth_header,
-            files={"file": ("test.txt", b"content", "text/plain")}
-        )
-        assert response.status_code == 429
+        assert converted.status_code == 200
+        assert converted.json()["status"] == "converted"
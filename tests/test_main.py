@@ -1,3 +0,0 @@
-"""Legacy tests — see test_api.py for comprehensive suite."""
-# This file is kept for backwards compatibility
-# All tests have been consolidated into test_api.py